@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the visibility, permission and validation hot paths.
+
+The benchmarks run against the test app on an in-memory SQLite database and
+report the median wall time and the number of queries of each scenario:
+
+    python benchmarks/run.py
+    python benchmarks/run.py --rows 10 1000 --save baseline.json
+    python benchmarks/run.py --baseline baseline.json --max-regression 20
+
+Timings are only comparable between runs on the same machine.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from collections import namedtuple
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.apps import apps  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.urls import reverse  # noqa: E402
+from rest_framework.request import Request  # noqa: E402
+from rest_framework.test import APIClient, APIRequestFactory  # noqa: E402
+
+from generic_permissions.config import (  # noqa: E402
+    PermissionsConfig,
+    ValidatorsConfig,
+    VisibilitiesConfig,
+)
+from generic_permissions.permissions import permission_for  # noqa: E402
+from generic_permissions.validation import validator_for  # noqa: E402
+from generic_permissions.visibilities import Union, filter_queryset_for  # noqa: E402
+from tests.models import Model1, Model2  # noqa: E402
+from tests.serializers import TestModel1Serializer  # noqa: E402
+from tests.views import BulkDummy1ViewSet, Dummy1ViewSet  # noqa: E402
+
+SCENARIOS = {}
+
+# The test app doesn't install `django.contrib.auth`
+User = namedtuple("User", "username")
+
+
+def scenario(name, scales_with_rows=True):
+    def decorate(func):
+        SCENARIOS[name] = (func, scales_with_rows)
+        return func
+
+    return decorate
+
+
+class Model2Visibility:
+    @filter_queryset_for(Model2)
+    def filter_queryset_for_model2(self, queryset, request):
+        return queryset.exclude(text="hidden")
+
+
+class PureModel1Visibility:
+    pure_filter = True
+
+    @filter_queryset_for(Model1)
+    def filter_queryset_for_model1(self, queryset, request):
+        return queryset.filter(text__startswith="a")
+
+
+class SubqueryModel1Visibility:
+    @filter_queryset_for(Model1)
+    def filter_queryset_for_model1(self, queryset, request):
+        return queryset.filter(model2__text="visible")
+
+
+class PureSubqueryModel1Visibility(SubqueryModel1Visibility):
+    pure_filter = True
+
+
+class MergedModel1Visibility(PureModel1Visibility):
+    pure_filter = False
+
+
+class Model1Union(Union):
+    visibility_classes = [PureModel1Visibility, SubqueryModel1Visibility]
+
+
+# The same filters as `Model1Union`, combined with OR or merged with UNION only
+class PureModel1Union(Union):
+    visibility_classes = [PureModel1Visibility, PureSubqueryModel1Visibility]
+
+
+class MergedModel1Union(Union):
+    visibility_classes = [MergedModel1Visibility, SubqueryModel1Visibility]
+
+
+def reset_config():
+    apps.get_app_config("generic_permissions").ready()
+
+
+def create_rows(num_rows):
+    Model1.many.through.objects.all().delete()
+    Model1.objects.all().delete()
+    Model2.objects.all().delete()
+
+    visible = Model2.objects.bulk_create(
+        Model2(text="visible") for _ in range(num_rows)
+    )
+    hidden = Model2.objects.bulk_create(Model2(text="hidden") for _ in range(num_rows))
+    model1s = Model1.objects.bulk_create(
+        Model1(text="abc" if i % 2 else "xyz", model2=model2)
+        for i, model2 in enumerate(visible)
+    )
+    Model1.many.through.objects.bulk_create(
+        Model1.many.through(model1=model1, model2=model2)
+        for model1, pair in zip(model1s, zip(visible, hidden, strict=True), strict=True)
+        for model2 in pair
+    )
+
+
+def list_endpoint(num_rows, visible_prefetch):
+    reset_config()
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(Model2Visibility)
+    create_rows(num_rows)
+    BulkDummy1ViewSet.visible_prefetch = visible_prefetch
+
+    client = APIClient()
+    client.force_authenticate(user=User(username="admin"))
+    url = reverse("bulk-model1-list")
+
+    def run():
+        response = client.get(url)
+        assert response.status_code == 200, response.status_code
+
+    return run
+
+
+@scenario("list, FK and M2M fields")
+def list_fk_m2m(num_rows):
+    return list_endpoint(num_rows, [])
+
+
+@scenario("list, FK and prefetched M2M fields")
+def list_fk_m2m_prefetched(num_rows):
+    return list_endpoint(num_rows, ["many"])
+
+
+def union_filter(num_rows, union_cls):
+    reset_config()
+    create_rows(num_rows)
+    request = Request(APIRequestFactory().get("/"))
+    union = union_cls()
+
+    def run():
+        list(union.filter_queryset(Model1.objects.all(), request))
+
+    run.explain = lambda: union.filter_queryset(Model1.objects.all(), request).explain()
+    return run
+
+
+@scenario("Union composition")
+def union(num_rows):
+    return union_filter(num_rows, Model1Union)
+
+
+@scenario("Union composition, pure filters (OR)")
+def union_pure(num_rows):
+    return union_filter(num_rows, PureModel1Union)
+
+
+@scenario("Union composition, merged filters (UNION)")
+def union_merged(num_rows):
+    return union_filter(num_rows, MergedModel1Union)
+
+
+@scenario("list validation")
+def validation(num_rows):
+    reset_config()
+    create_rows(0)
+
+    validators = []
+    for i in range(10):
+
+        class TextValidator:
+            @validator_for(Model1, cost=i)
+            def validate_text(self, data, context):
+                return data
+
+        validators.append(TextValidator)
+
+    ValidatorsConfig.clear_handlers()
+    for validator in validators:
+        ValidatorsConfig.register_handler_class(validator)
+
+    request = Request(APIRequestFactory().post("/"))
+    data = [{"text": "foo", "explicit": []} for _ in range(num_rows)]
+
+    def run():
+        serializer = TestModel1Serializer(
+            data=data, many=True, context={"request": request}
+        )
+        assert serializer.is_valid(), serializer.errors
+
+    return run
+
+
+@scenario("permission check, 100 handler classes", scales_with_rows=False)
+def many_handlers(num_rows):
+    reset_config()
+    PermissionsConfig.clear_handlers()
+    for _ in range(100):
+
+        class Permission:
+            @permission_for(Model1)
+            def has_permission(self, request, *args, **kwargs):
+                return True
+
+        PermissionsConfig.register_handler_class(Permission)
+
+    request = Request(APIRequestFactory().post("/"))
+
+    def run():
+        for _ in range(100):
+            view = Dummy1ViewSet(request=request, action="create")
+            view._check_permissions(request)
+
+    return run
+
+
+@scenario("handler lookup, 50 levels of inheritance", scales_with_rows=False)
+def deep_mro(num_rows):
+    reset_config()
+    # The handler lookup only walks the MRO, so plain classes will do
+    classes = [type("Level0", (), {})]
+    for i in range(1, 50):
+        classes.append(type(f"Level{i}", (classes[-1],), {}))
+
+    class Visibility:
+        @filter_queryset_for(classes[0])
+        def filter_queryset_for_base(self, queryset, request):
+            return queryset
+
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(Visibility)
+    deepest = classes[-1]
+
+    def run():
+        for _ in range(1000):
+            VisibilitiesConfig.get_handlers(deepest)
+
+    return run
+
+
+def measure(run, repeat):
+    run()  # warm up
+
+    queries = 0
+
+    def count_queries(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    durations = []
+    for _ in range(repeat):
+        queries = 0
+        with connection.execute_wrapper(count_queries):
+            start = time.perf_counter()
+            run()
+            durations.append(time.perf_counter() - start)
+    return statistics.median(durations), queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="only run scenarios containing this text")
+    parser.add_argument("--explain", action="store_true", help="print query plans")
+    parser.add_argument("--save", type=Path, help="save the results as JSON")
+    parser.add_argument("--baseline", type=Path, help="compare to saved results")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        help="fail if a scenario got slower by more than this percentage",
+    )
+    args = parser.parse_args()
+
+    setup_test_environment()
+    call_command("migrate", verbosity=0)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else {}
+
+    results = {}
+    regressions = []
+    print(
+        f"{'scenario':<45} {'rows':>6} {'median ms':>10} {'queries':>8} {'change':>8}"
+    )
+    for name, (setup, scales_with_rows) in SCENARIOS.items():
+        if args.only and args.only not in name:
+            continue
+
+        for num_rows in args.rows if scales_with_rows else [0]:
+            key = f"{name} [{num_rows}]"
+            run = setup(num_rows)
+            duration, queries = measure(run, args.repeat)
+            results[key] = {"duration": duration, "queries": queries}
+
+            change = ""
+            if key in baseline:
+                percent = (duration / baseline[key]["duration"] - 1) * 100
+                change = f"{percent:+.0f}%"
+                if args.max_regression is not None and percent > args.max_regression:
+                    regressions.append(key)
+                if queries != baseline[key]["queries"]:
+                    change += f" ({baseline[key]['queries']} queries)"
+
+            print(
+                f"{name:<45} {num_rows or '':>6} {duration * 1000:>10.2f} "
+                f"{queries:>8} {change:>8}"
+            )
+            if args.explain and hasattr(run, "explain"):
+                print(f"  query plan of {key}:")
+                print("\n".join(f"    {line}" for line in run.explain().splitlines()))
+
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2) + "\n")
+
+    if regressions:
+        print(f"Regressions of more than {args.max_regression}%:")
+        print("\n".join(f"- {key}" for key in regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,9 +5,11 @@ from django.utils.module_loading import import_string
 from generic_permissions.config import (
     ObjectPermissionsConfig,
     PermissionsConfig,
+    QuerysetPermissionsConfig,
     ValidatorsConfig,
     VisibilitiesConfig,
 )
+from generic_permissions.instrumentation import configure_instrumentation
 
 
 class GenericPermissionsConfig(AppConfig):
@@ -17,12 +19,16 @@ class GenericPermissionsConfig(AppConfig):
     def ready(self):
         # prevent importing before django is ready
         from generic_permissions.permissions import AllowAny
-        from generic_permissions.visibilities import Any
+        from generic_permissions.visibilities import (
+            Any,
+            clear_compiled_filters,
+            compile_bypass_index,
+        )
 
         self._init_config(
             "GENERIC_PERMISSIONS_PERMISSION_CLASSES",
             [AllowAny],
-            [ObjectPermissionsConfig, PermissionsConfig],
+            [ObjectPermissionsConfig, PermissionsConfig, QuerysetPermissionsConfig],
         )
 
         self._init_config(
@@ -33,6 +39,10 @@ class GenericPermissionsConfig(AppConfig):
             "GENERIC_PERMISSIONS_VALIDATION_CLASSES", [], [ValidatorsConfig]
         )
 
+        compile_bypass_index()
+        clear_compiled_filters()
+        configure_instrumentation()
+
     def _init_config(self, setting_name, defaults, configs):
         classes = defaults
         classes_strings = getattr(settings, setting_name, None)
@@ -1,43 +1,112 @@
 import inspect
 from collections import defaultdict
-from functools import wraps
+from functools import update_wrapper, wraps
 
+from asgiref.sync import async_to_sync, sync_to_async
 from django.core.exceptions import ImproperlyConfigured
 
+from . import instrumentation
+
 
 class MethodDecorator:
     def __init__(self, purpose_attr_name):
         self._attr_name = purpose_attr_name
+        self._options_attr_name = f"{purpose_attr_name}_options"
 
-    def __call__(self, model_cls):
+    def __call__(self, model_cls, **options):
         """Decorate custom validator method.
 
         Decorate your validator methods to mark which
-        model they can be used for.
+        model they can be used for. Keyword arguments are stored as options
+        of the handler, e.g. `@object_permission_for(Model, bulk=True)`.
         """
 
         def _add_dgap_decoration(func):
             attr = getattr(func, self._attr_name, None)
             if attr:
                 attr.append(model_cls)
+                getattr(func, self._options_attr_name).update(options)
                 return func
 
-            @wraps(func)
-            def wrapped(*args, **kwargs):
-                return func(*args, **kwargs)
+            if inspect.iscoroutinefunction(func):
+
+                @wraps(func)
+                async def wrapped(*args, **kwargs):
+                    return await func(*args, **kwargs)
+
+            else:
+
+                @wraps(func)
+                def wrapped(*args, **kwargs):
+                    return func(*args, **kwargs)
 
             setattr(wrapped, self._attr_name, [model_cls])
+            setattr(wrapped, self._options_attr_name, dict(options))
 
             return wrapped
 
         return _add_dgap_decoration
 
 
+class Lifecycle:
+    """Instantiation modes for handler classes.
+
+    Set the `handler_lifecycle` attribute of a handler class to one of these
+    values to control how often the class is instantiated:
+
+    - `PER_CALL`: a fresh instance on every handler lookup (default)
+    - `PER_REQUEST`: one instance per request, stored on the request
+    - `SINGLETON`: one instance for the whole process
+    """
+
+    PER_CALL = "per_call"
+    PER_REQUEST = "per_request"
+    SINGLETON = "singleton"
+
+    ALL = (PER_CALL, PER_REQUEST, SINGLETON)
+
+
+def _is_async(handler):
+    return inspect.iscoroutinefunction(handler)
+
+
+def _to_sync(handler):
+    # Keep the handler's name, e.g. for the instrumentation, and its
+    # instance, e.g. for the `Composition`
+    sync_handler = update_wrapper(async_to_sync(handler), handler)
+    sync_handler.__self__ = handler.__self__
+    return sync_handler
+
+
+def request_cache(request, name):
+    """Return a dict to cache data for the duration of the given request.
+
+    The caches are stored on the underlying Django `HttpRequest`, so they
+    are shared between it and the DRF `Request` wrapping it. Without a
+    request, a throwaway dict is returned.
+    """
+    if request is None:
+        return {}
+
+    request = getattr(request, "_request", request)
+    caches = getattr(request, "_dgap_cache", None)
+    if caches is None:
+        caches = request._dgap_cache = {}
+    return caches.setdefault(name, {})
+
+
 class DGAPConfigManager:
     def __init__(self, purpose):
         self._purpose = purpose
         # Handlers map from model class -> list-of-handlers
         self._handlers = defaultdict(list)
+        # Resolution table: model class -> (handler class, method name) pairs.
+        # Built lazily per model and reset whenever the registry changes
+        self._resolved = {}
+        # Handler class -> instance, for handlers with a singleton lifecycle
+        self._singletons = {}
+        # (handler class, method name) -> options passed to the decorator
+        self._options = {}
         self._purpose_attr = f"_dgap_handler_for_{self._purpose}"
 
         self.decorator = MethodDecorator(self._purpose_attr)
@@ -48,6 +117,113 @@ class DGAPConfigManager:
         Additional args and kwargs can be passed - those will be used to
         initialize the handler class.
         """
+        return [
+            handler
+            for handler, _ in self.get_handlers_with_options(model_cls, *args, **kwargs)
+        ]
+
+    def get_handlers_with_options(self, model_cls, *args, **kwargs):
+        """Return (callable, options) pairs to handle the given model.
+
+        The options are the keyword arguments the handler's method was
+        decorated with, e.g. `{"bulk": True}`. Handlers defined with
+        `async def` are wrapped to be called synchronously.
+        """
+        return self._handlers_for_request(model_cls, None, args, kwargs)
+
+    def get_async_handlers(self, model_cls, *args, **kwargs):
+        """Return a list of coroutine functions to handle the given model.
+
+        Like `get_handlers()`, but for async code: Synchronous handlers are
+        wrapped to run in a thread with `sync_to_async`.
+        """
+        return [
+            handler
+            for handler, _ in self.get_async_handlers_with_options(
+                model_cls, *args, **kwargs
+            )
+        ]
+
+    def get_async_handlers_with_options(self, model_cls, *args, **kwargs):
+        """Return (coroutine function, options) pairs to handle the given model."""
+        return self._async_handlers_for_request(model_cls, None, args, kwargs)
+
+    def _handlers_for_request(self, model_cls, request, args=(), kwargs=None):
+        # Like `get_handlers_with_options()`. The request is only used to
+        # store the instances of handler classes with a per-request lifecycle
+        handlers = [
+            (_to_sync(handler) if _is_async(handler) else handler, options)
+            for handler, options in self._get_handlers_with_options(
+                model_cls, request, args, kwargs or {}
+            )
+        ]
+        if instrumentation.is_enabled():
+            handlers = [
+                (
+                    instrumentation.InstrumentedHandler(
+                        handler, self._purpose, model_cls
+                    ),
+                    options,
+                )
+                for handler, options in handlers
+            ]
+        return handlers
+
+    def _async_handlers_for_request(self, model_cls, request, args=(), kwargs=None):
+        handlers = []
+        for handler, options in self._get_handlers_with_options(
+            model_cls, request, args, kwargs or {}
+        ):
+            if _is_async(handler):
+                if instrumentation.is_enabled():
+                    handler = instrumentation.AsyncInstrumentedHandler(
+                        handler, self._purpose, model_cls
+                    )
+            else:
+                if instrumentation.is_enabled():
+                    handler = instrumentation.InstrumentedHandler(
+                        handler, self._purpose, model_cls
+                    )
+                handler = sync_to_async(handler)
+            handlers.append((handler, options))
+        return handlers
+
+    def _get_handlers_with_options(self, model_cls, request, args, kwargs):
+        return [
+            (
+                getattr(
+                    self._get_instance(handler_cls, request, args, kwargs), func_name
+                ),
+                self._options[handler_cls, func_name],
+            )
+            for handler_cls, func_name in self._resolve(model_cls)
+        ]
+
+    def _get_instance(self, handler_cls, request, args, kwargs):
+        lifecycle = getattr(handler_cls, "handler_lifecycle", Lifecycle.PER_CALL)
+
+        if lifecycle == Lifecycle.SINGLETON:
+            instances = self._singletons
+        elif lifecycle == Lifecycle.PER_REQUEST and request is not None:
+            instances = request_cache(request, "handler_instances")
+        else:
+            return handler_cls(*args, **kwargs)
+
+        instance = instances.get(handler_cls)
+        if instance is None:
+            instance = instances[handler_cls] = handler_cls(*args, **kwargs)
+        return instance
+
+    def _resolve(self, model_cls):
+        """Return the (handler class, method name) pairs for the given model.
+
+        The result is cached per model class, so the MRO walk only happens
+        once after each change to the registered handlers.
+        """
+        try:
+            return self._resolved[model_cls]
+        except KeyError:
+            pass
 
         # There may be fallback handlers defined on a handler class.
         # We should only return the most specific handler for a given
@@ -70,12 +246,18 @@ class DGAPConfigManager:
             for handler_cls, func_name in self._handlers[cls_to_handle]
         }
 
-        return [
-            getattr(handler_cls(*args, **kwargs), func_name)
-            for handler_cls, func_name in handler_cls_and_method.items()
-        ]
+        resolved = tuple(handler_cls_and_method.items())
+        self._resolved[model_cls] = resolved
+        return resolved
 
     def register_handler_class(self, handler_cls):
+        lifecycle = getattr(handler_cls, "handler_lifecycle", Lifecycle.PER_CALL)
+        if lifecycle not in Lifecycle.ALL:
+            raise ImproperlyConfigured(
+                f"{handler_cls.__name__} has an invalid handler_lifecycle "
+                f"{lifecycle!r}. Valid choices are: {', '.join(Lifecycle.ALL)}"
+            )
+
         perm_fns = self.marked_methods(handler_cls)
 
         seen_models = set()
@@ -90,6 +272,12 @@ class DGAPConfigManager:
                 seen_models.add(model)
                 self._handlers[model].append((handler_cls, func_name))
 
+            self._options[handler_cls, func_name] = getattr(
+                getattr(handler_cls, func_name), self.decorator._options_attr_name, {}
+            )
+
+        self._resolved = {}
+
     def _purpose_hasattr(self, handler):
         return hasattr(handler, self._purpose_attr)
 
@@ -109,9 +297,13 @@ class DGAPConfigManager:
         `ValidatorMixin`, but not the ones of the `PermissionMixin` etc.
         """
         self._handlers = defaultdict(list)
+        self._resolved = {}
+        self._singletons = {}
+        self._options = {}
 
 
 PermissionsConfig = DGAPConfigManager(purpose="permission")
 ObjectPermissionsConfig = DGAPConfigManager(purpose="object_permission")
+QuerysetPermissionsConfig = DGAPConfigManager(purpose="queryset_permission")
 VisibilitiesConfig = DGAPConfigManager(purpose="visibility")
 ValidatorsConfig = DGAPConfigManager(purpose="validator")
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class MaterializationConfig(AppConfig):
+    name = "generic_permissions.contrib.materialization"
+    label = "dgap_materialization"
+    default_auto_field = "django.db.models.BigAutoField"
+    verbose_name = "Django Generic API Permissions: Materialized visibilities"
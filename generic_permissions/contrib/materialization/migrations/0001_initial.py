@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="MaterializedPrincipal",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("materialization", models.CharField(max_length=255)),
+                ("principal_key", models.CharField(max_length=255)),
+                ("principal", models.TextField()),
+                ("model_label", models.CharField(max_length=255)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("materialization", "principal_key", "model_label"),
+                        name="dgap_materialized_principal_unique",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="MaterializedVisibility",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("materialization", models.CharField(max_length=255)),
+                ("principal_key", models.CharField(max_length=255)),
+                ("model_label", models.CharField(max_length=255)),
+                ("object_pk", models.CharField(max_length=255)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["materialization", "model_label", "object_pk"],
+                        name="dgap_materialized_object_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=(
+                            "materialization",
+                            "principal_key",
+                            "model_label",
+                            "object_pk",
+                        ),
+                        name="dgap_materialized_visibility_unique",
+                    )
+                ],
+            },
+        ),
+    ]
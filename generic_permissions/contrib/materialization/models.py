@@ -0,0 +1,42 @@
+from django.db import models
+
+
+class MaterializedVisibility(models.Model):
+    """An object visible to a principal, see `Materialized`."""
+
+    materialization = models.CharField(max_length=255)
+    principal_key = models.CharField(max_length=255)
+    model_label = models.CharField(max_length=255)
+    object_pk = models.CharField(max_length=255)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["materialization", "principal_key", "model_label", "object_pk"],
+                name="dgap_materialized_visibility_unique",
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["materialization", "model_label", "object_pk"],
+                name="dgap_materialized_object_idx",
+            )
+        ]
+
+
+class MaterializedPrincipal(models.Model):
+    """Marks the visibilities of a principal for a model as materialized."""
+
+    materialization = models.CharField(max_length=255)
+    principal_key = models.CharField(max_length=255)
+    # The canonical JSON of the principal key, to refresh its rows with
+    principal = models.TextField()
+    model_label = models.CharField(max_length=255)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["materialization", "principal_key", "model_label"],
+                name="dgap_materialized_principal_unique",
+            )
+        ]
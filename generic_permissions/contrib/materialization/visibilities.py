@@ -0,0 +1,317 @@
+import json
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import CharField, Exists, OuterRef
+from django.db.models.functions import Cast
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from generic_permissions.visibilities import (
+    Composition,
+    canonical_principal_key,
+    filter_queryset_for,
+    principal_key_digest,
+)
+
+from .models import MaterializedPrincipal, MaterializedVisibility
+
+"""
+Materialize expensive visibilities into a table.
+
+The objects visible through the configured visibility classes are stored per
+principal (the user by default) and model in the `MaterializedVisibility`
+table. Requests are then filtered with an indexed semi-join against it.
+
+A principal's rows for a model are computed on its first request for that
+model. When one of the `depends_on` models changes, only the rows of the
+affected models are refreshed:
+
+- Changed objects of a materialized model are evaluated again for each
+  principal, if the class can build a request for it with
+  `get_principal_request()`. Otherwise the rows of the model are dropped,
+  and computed again on the next request of each principal.
+- Deleted objects of a materialized model are removed from the table.
+- For the other materialized models depending on the changed model, the
+  objects returned by `get_affected_objects()` are refreshed the same way.
+  By default, their rows are dropped.
+
+Example:
+```
+>>> from generic_permissions.contrib.materialization.visibilities import Materialized
+>>> class MaterializedDocumentVisibility(Materialized):
+...     visibility_classes = [TenantACLVisibility]
+...     depends_on = {Document: [ACLEntry, GroupMembership]}
+```
+"""
+
+
+class Materialized(Composition):
+    """Serve the visibilities of the configured classes from a materialized table.
+
+    Call `reset()` after changing the configured classes, e.g. in a data
+    migration, to drop the rows computed with the old rules.
+    """
+
+    # The models the materialized rows depend on. Either a dict mapping each
+    # materialized model to the models its visibility depends on, or a list
+    # if all materialized models may depend on all of them
+    depends_on = []
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for model in cls._dependency_models():
+            post_save.connect(cls._saved_receiver, sender=model, weak=False)
+            post_delete.connect(cls._deleted_receiver, sender=model, weak=False)
+        if cls.depends_on:
+            m2m_changed.connect(cls._m2m_changed_receiver, weak=False)
+
+    @classmethod
+    def _dependency_models(cls):
+        if not isinstance(cls.depends_on, dict):
+            return set(cls.depends_on)
+        return set(cls.depends_on).union(*cls.depends_on.values())
+
+    @classmethod
+    def _receiver_instance(cls):
+        # The receivers share one instance, so the configured classes are
+        # only registered once
+        instance = cls.__dict__.get("_dgap_receiver_instance")
+        if instance is None:
+            instance = cls()
+            cls._dgap_receiver_instance = instance
+        return instance
+
+    @classmethod
+    def _materialization(cls):
+        return f"{cls.__module__}.{cls.__qualname__}"
+
+    @classmethod
+    def _rows(cls, model=None):
+        rows = MaterializedVisibility.objects.filter(
+            materialization=cls._materialization()
+        )
+        if model is not None:
+            rows = rows.filter(model_label=model._meta.label)
+        return rows
+
+    @classmethod
+    def _principals(cls, model=None):
+        principals = MaterializedPrincipal.objects.filter(
+            materialization=cls._materialization()
+        )
+        if model is not None:
+            principals = principals.filter(model_label=model._meta.label)
+        return principals
+
+    @classmethod
+    def reset(cls, model=None):
+        """Drop the materialized rows, of all models or only the given one."""
+        with transaction.atomic():
+            cls._principals(model).delete()
+            cls._rows(model).delete()
+
+    @classmethod
+    def _saved_receiver(cls, sender, instance, **kwargs):
+        cls._receiver_instance()._objects_changed(sender, [instance])
+
+    @classmethod
+    def _deleted_receiver(cls, sender, instance, **kwargs):
+        cls._receiver_instance()._objects_changed(sender, [instance], deleted=True)
+
+    @classmethod
+    def _m2m_changed_receiver(cls, sender, instance, action, model, pk_set, **kwargs):
+        if action.startswith("pre_"):
+            return
+        dependencies = cls._dependency_models()
+        if not {sender, type(instance), model} & dependencies:
+            return
+
+        # The objects on both sides of the relation are refreshed, so they
+        # don't need to be refreshed again as objects affected by the other side
+        materialization = cls._receiver_instance()
+        refreshed = {type(instance), model} & dependencies
+        with transaction.atomic():
+            if sender in dependencies:
+                # The rows of the intermediate model are gone already
+                materialization._objects_changed(sender, None, refreshed=refreshed)
+            if type(instance) in dependencies:
+                materialization._objects_changed(
+                    type(instance), [instance], refreshed=refreshed
+                )
+            if model in dependencies:
+                # The objects are unknown when the relation is cleared
+                objects = (
+                    None
+                    if pk_set is None
+                    else model._default_manager.filter(pk__in=pk_set)
+                )
+                materialization._objects_changed(model, objects, refreshed=refreshed)
+
+    def get_principal_key(self, request):
+        """Return the principal the visibility of the request depends on.
+
+        This is the principal key of the configured classes if they all
+        declare one, and the primary key of the user otherwise. The rows are
+        stored with the digest of the key, see `principal_key_digest()`.
+        """
+        principal_key = super().get_principal_key(request)
+        return request.user.pk if principal_key is None else principal_key
+
+    def get_principal_request(self, principal_key):
+        """Return a request to evaluate the visibilities of a principal with.
+
+        `principal_key` is the key returned by `get_principal_key()`, decoded
+        from its canonical JSON, so tuples and sets are passed as lists.
+
+        Implement this to refresh changed objects incrementally. The objects
+        are evaluated for each materialized principal, in the transaction
+        saving them, so this only pays off with few principals, e.g. with
+        principal keys shared by many users.
+
+        By default, `None` is returned and the rows of the changed model are
+        dropped instead.
+        """
+        return None
+
+    def get_affected_objects(self, model, changed_model, changed_objects):
+        """Return the objects of `model` affected by changes to other objects.
+
+        `changed_objects` are the saved or deleted objects of `changed_model`,
+        one of the models `model` depends on. Return the primary keys of the
+        objects of `model` whose visibility may have changed, or `None` if
+        they are unknown. In that case, all rows of `model` are dropped.
+        """
+        return None
+
+    def _affected_models(self, changed_model):
+        if isinstance(self.depends_on, dict):
+            return [
+                model
+                for model, dependencies in self.depends_on.items()
+                if changed_model in dependencies and model is not changed_model
+            ]
+
+        labels = (
+            self._principals()
+            .exclude(model_label=changed_model._meta.label)
+            .values_list("model_label", flat=True)
+            .distinct()
+        )
+        return [apps.get_model(label) for label in labels]
+
+    def _objects_changed(self, model, objects, deleted=False, refreshed=()):
+        """Refresh the rows affected by changes to the given objects.
+
+        `objects` is `None` if the changed objects are unknown. The rows of
+        the `refreshed` models are refreshed separately.
+        """
+        with transaction.atomic():
+            if objects is None:
+                self.reset(model)
+            elif deleted:
+                self._rows(model).filter(
+                    object_pk__in=[str(obj.pk) for obj in objects]
+                ).delete()
+            else:
+                self._refresh(model, [obj.pk for obj in objects])
+
+            for affected_model in self._affected_models(model):
+                if (
+                    affected_model in refreshed
+                    or not self._principals(affected_model).exists()
+                ):
+                    continue
+                pks = (
+                    None
+                    if objects is None
+                    else self.get_affected_objects(affected_model, model, objects)
+                )
+                if pks is None:
+                    self.reset(affected_model)
+                else:
+                    self._refresh(affected_model, pks)
+
+    def _refresh(self, model, pks):
+        pks = {str(pk) for pk in pks}
+        principals = list(
+            self._principals(model).values_list("principal_key", "principal")
+        )
+        if not pks or not principals:
+            return
+
+        for principal_key, principal in principals:
+            request = self.get_principal_request(json.loads(principal))
+            if request is None:
+                self.reset(model)
+                return
+
+            visible = model._default_manager.filter(pk__in=pks)
+            for handler in self.get_handlers(model, request):
+                visible = handler(visible, request)
+            visible_pks = {str(pk) for pk in visible.values_list("pk", flat=True)}
+
+            rows = self._rows(model).filter(principal_key=principal_key)
+            rows.filter(object_pk__in=pks - visible_pks).delete()
+            self._insert_rows(principal_key, model, visible_pks)
+
+    def _insert_rows(self, principal_key, model, pks):
+        MaterializedVisibility.objects.bulk_create(
+            (
+                MaterializedVisibility(
+                    materialization=self._materialization(),
+                    principal_key=principal_key,
+                    model_label=model._meta.label,
+                    object_pk=pk,
+                )
+                for pk in pks
+            ),
+            ignore_conflicts=True,
+        )
+
+    def materialize(self, model, request):
+        """Compute the rows of the request's principal for the given model."""
+        principal = self.get_principal_key(request)
+        principal_key = principal_key_digest(principal)
+
+        visible = model._default_manager.all()
+        for handler in self.get_handlers(model, request):
+            visible = handler(visible, request)
+
+        with transaction.atomic():
+            self._rows(model).filter(principal_key=principal_key).delete()
+            self._insert_rows(
+                principal_key,
+                model,
+                (str(pk) for pk in visible.values_list("pk", flat=True).iterator()),
+            )
+            MaterializedPrincipal.objects.bulk_create(
+                [
+                    MaterializedPrincipal(
+                        materialization=self._materialization(),
+                        principal_key=principal_key,
+                        principal=canonical_principal_key(principal),
+                        model_label=model._meta.label,
+                    )
+                ],
+                ignore_conflicts=True,
+            )
+
+    @filter_queryset_for(object)
+    def filter_queryset(self, queryset, request):
+        if not self.get_handlers(queryset.model, request):
+            return queryset
+
+        model = queryset.model
+        principal_key = principal_key_digest(self.get_principal_key(request))
+        principals = self._principals(model).filter(principal_key=principal_key)
+        if not principals.exists():
+            self.materialize(model, request)
+
+        return queryset.filter(
+            Exists(
+                self._rows(model).filter(
+                    principal_key=principal_key,
+                    object_pk=Cast(OuterRef("pk"), output_field=CharField()),
+                )
+            )
+        )
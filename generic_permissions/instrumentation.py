@@ -0,0 +1,226 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+from contextlib import ExitStack
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.dispatch import Signal, receiver
+from django.test.signals import setting_changed
+from django.utils.module_loading import import_string
+
+"""
+Opt-in profiling of visibility, permission and validator handlers.
+
+Configure one or more sinks with the `GENERIC_PERMISSIONS_INSTRUMENTATION_SINKS`
+setting to record each handler call. A sink is a callable receiving a
+`HandlerExecution`:
+
+```
+>>> GENERIC_PERMISSIONS_INSTRUMENTATION_SINKS = [
+...     "generic_permissions.instrumentation.log_sink",
+...     "generic_permissions.instrumentation.registry_sink",
+... ]
+```
+
+Without sinks, the handlers are not wrapped at all.
+"""
+
+logger = logging.getLogger(__name__)
+
+HandlerExecution = namedtuple(
+    "HandlerExecution", "purpose model handler duration queries"
+)
+
+# Sent for each handler call with the `execution` by the `signal_sink`
+handler_executed = Signal()
+
+# The configured sinks, the handlers are only instrumented if there are any
+_sinks = []
+
+# Active `VisibilityQueryCounter`s, the visibility regions are only tracked
+# while there are any
+_visibility_counters = []
+_in_visibility_region = ContextVar("dgap_in_visibility_region", default=False)
+
+
+def configure_instrumentation():
+    """Load the sinks from the `GENERIC_PERMISSIONS_INSTRUMENTATION_SINKS` setting."""
+    _sinks[:] = [
+        import_string(sink) if isinstance(sink, str) else sink
+        for sink in getattr(settings, "GENERIC_PERMISSIONS_INSTRUMENTATION_SINKS", [])
+    ]
+
+
+@receiver(setting_changed)
+def _instrumentation_setting_changed(setting, **kwargs):
+    if setting == "GENERIC_PERMISSIONS_INSTRUMENTATION_SINKS":
+        configure_instrumentation()
+
+
+def is_enabled():
+    return bool(_sinks)
+
+
+class InstrumentedHandler:
+    """Wrap a handler to record its calls to the configured sinks.
+
+    Attributes of the handler, e.g. `__self__`, are passed through.
+    """
+
+    def __init__(self, handler, purpose, model):
+        self._handler = handler
+        self._purpose = purpose
+        self._model = model
+
+    def __getattr__(self, name):
+        return getattr(self._handler, name)
+
+    def __call__(self, *args, **kwargs):
+        queries = [0]
+
+        def count_queries(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(count_queries))
+                return self._handler(*args, **kwargs)
+        finally:
+            self._record(start, queries[0])
+
+    def _record(self, start, queries):
+        execution = HandlerExecution(
+            purpose=self._purpose,
+            model=self._model,
+            handler=f"{self._handler.__module__}.{self._handler.__qualname__}",
+            duration=time.perf_counter() - start,
+            queries=queries,
+        )
+        for sink in _sinks:
+            sink(execution)
+
+
+class AsyncInstrumentedHandler(InstrumentedHandler):
+    """Wrap an async handler to record its calls to the configured sinks.
+
+    Only the wall time is recorded. Database queries of async code run in
+    other threads, so they aren't counted.
+    """
+
+    async def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self._handler(*args, **kwargs)
+        finally:
+            self._record(start, 0)
+
+
+def log_sink(execution):
+    """Log each handler call on the debug level."""
+    logger.debug(
+        "%s handler %s for %s took %.2fms with %d queries",
+        execution.purpose,
+        execution.handler,
+        execution.model.__name__,
+        execution.duration * 1000,
+        execution.queries,
+    )
+
+
+def signal_sink(execution):
+    """Send the `handler_executed` signal for each handler call."""
+    handler_executed.send(sender=execution.model, execution=execution)
+
+
+class HandlerStatsRegistry:
+    """Aggregate the handler calls in process.
+
+    The stats are keyed by (purpose, model label, handler) and contain the
+    number of `calls`, the total `duration` in seconds and the number of
+    `queries`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def __call__(self, execution):
+        key = (execution.purpose, execution.model._meta.label, execution.handler)
+        with self._lock:
+            stats = self._stats.setdefault(
+                key, {"calls": 0, "duration": 0.0, "queries": 0}
+            )
+            stats["calls"] += 1
+            stats["duration"] += execution.duration
+            stats["queries"] += execution.queries
+
+    def get_stats(self):
+        with self._lock:
+            return {key: dict(stats) for key, stats in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+registry_sink = HandlerStatsRegistry()
+
+
+class VisibilityQueryWarning(RuntimeWarning):
+    """Visibility queries were run for every serialized row."""
+
+
+def visibility_region(func):
+    """Mark the queries run by `func` as visibility queries."""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _visibility_counters:
+            return func(*args, **kwargs)
+
+        token = _in_visibility_region.set(True)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _in_visibility_region.reset(token)
+
+    return wrapper
+
+
+class VisibilityQueryCounter:
+    """Count the queries run by the visibility related fields and serializers.
+
+    Use as a context manager. The SQL of the counted queries is available in
+    `queries`.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self._stack = None
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    def __call__(self, execute, sql, params, many, context):
+        if _in_visibility_region.get():
+            self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        _visibility_counters.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _visibility_counters.remove(self)
+        self._stack.close()
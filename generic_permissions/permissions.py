@@ -1,23 +1,152 @@
+import asyncio
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from functools import partial
 from warnings import warn
 
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
 from django.core.exceptions import PermissionDenied
+from django.db import close_old_connections
+from django.db.models import Exists, OuterRef, Value
+from django.dispatch import receiver
+from django.test.signals import setting_changed
 
-from .config import ObjectPermissionsConfig, PermissionsConfig
+from .config import (
+    ObjectPermissionsConfig,
+    PermissionsConfig,
+    QuerysetPermissionsConfig,
+)
 
 permission_for = PermissionsConfig.decorator
 object_permission_for = ObjectPermissionsConfig.decorator
+queryset_permission_for = QuerysetPermissionsConfig.decorator
+
+
+# (view class, action) -> model the permissions are checked for
+_permission_models = {}
+
+# Process wide thread pool to evaluate permission handlers concurrently,
+# created on first use
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(
+                    settings, "GENERIC_PERMISSIONS_CONCURRENT_MAX_WORKERS", None
+                ),
+                thread_name_prefix="dgap-permissions",
+            )
+        return _executor
+
+
+@receiver(setting_changed)
+def _executor_setting_changed(setting, **kwargs):
+    global _executor
+    if setting == "GENERIC_PERMISSIONS_CONCURRENT_MAX_WORKERS":
+        with _executor_lock:
+            if _executor is not None:
+                _executor.shutdown(cancel_futures=True)
+            _executor = None
+
+
+def _run_check(context, check):
+    try:
+        return context.run(check)
+    finally:
+        # Worker threads have their own database connections, treat them
+        # like at the end of a request
+        close_old_connections()
+
+
+def _all_granted_concurrently(checks):
+    """Run the checks in the thread pool, stop at the first denial."""
+    executor = _get_executor()
+    pending = {executor.submit(_run_check, copy_context(), check) for check in checks}
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if not all(future.result() for future in done):
+                return False
+        return True
+    finally:
+        # Checks already running can't be interrupted, but the ones which
+        # haven't started yet are dropped
+        for future in pending:
+            future.cancel()
+
+
+def _bulk_granted(handler, request, instances, pks, action):
+    return pks <= set(handler(request, instances, action=action))
 
 
 class PermissionViewMixin:
+    # Evaluate the permission handlers concurrently in a process wide thread
+    # pool. `None` uses the `GENERIC_PERMISSIONS_CONCURRENT_PERMISSIONS` setting
+    concurrent_permissions = None
+
+    def get_permission_model(self):
+        """
+        Return the model the permissions of this view are checked for.
+
+        The model is taken from the serializer class' `Meta.model`, with a
+        fallback to the model of the view's `queryset`. It's resolved once
+        per view class and action, so overwrite this method if the
+        serializer class depends on something else, e.g. the request user.
+        """
+        key = (type(self), getattr(self, "action", None))
+        try:
+            return _permission_models[key]
+        except KeyError:
+            pass
+
+        try:
+            model = self.get_serializer_class().Meta.model
+        except AttributeError:
+            model = self.queryset.model
+
+        _permission_models[key] = model
+        return model
+
+    def _get_permission_handlers(self, config, request):
+        # The handlers are resolved once per view instance, i.e. per request
+        handlers = self.__dict__.setdefault("_dgap_permission_handlers", {})
+        if config not in handlers:
+            handlers[config] = config._handlers_for_request(
+                self.get_permission_model(), request
+            )
+        return handlers[config]
+
+    def _all_granted(self, checks):
+        concurrent = self.concurrent_permissions
+        if concurrent is None:
+            concurrent = getattr(
+                settings, "GENERIC_PERMISSIONS_CONCURRENT_PERMISSIONS", False
+            )
+
+        if concurrent and len(checks) > 1:
+            return _all_granted_concurrently(checks)
+        return all(check() for check in checks)
+
     def _check_permissions(self, request):
         """
         Check if access to model is granted.
 
         Raise PermissionDenied if configured permissions do not allow accesss to the model.
         """
-        for handler in PermissionsConfig.get_handlers(self.get_serializer().Meta.model):
-            if not handler(request, action=getattr(self, "action", None)):
-                raise PermissionDenied()
+        action = getattr(self, "action", None)
+        checks = [
+            partial(handler, request, action=action)
+            for handler, _ in self._get_permission_handlers(PermissionsConfig, request)
+        ]
+        if not self._all_granted(checks):
+            raise PermissionDenied()
 
     def check_permissions(self, request):
         """
@@ -33,11 +162,7 @@ class PermissionViewMixin:
 
         Raise PermissionDenied if configured permissions do not allow accesss to the object.
         """
-        for handler in ObjectPermissionsConfig.get_handlers(
-            self.get_serializer().Meta.model
-        ):
-            if not handler(request, instance, action=getattr(self, "action", None)):
-                raise PermissionDenied()
+        self._check_objects_permissions(request, [instance])
 
     def check_object_permissions(self, request, instance):
         """
@@ -47,6 +172,164 @@ class PermissionViewMixin:
         if request.method != "GET":
             self._check_object_permissions(request, instance)
 
+    def _check_bulk_object_permissions(self, request, instances):
+        """
+        Check if access to all given objects is granted.
+
+        Bulk handlers are called once with all the objects, the others once
+        per object. Raise PermissionDenied if configured permissions do not
+        allow access to any of the objects.
+        """
+        self._check_objects_permissions(request, instances)
+
+    def _check_objects_permissions(self, request, instances):
+        action = getattr(self, "action", None)
+        pks = {instance.pk for instance in instances}
+
+        checks = []
+        for handler, options in self._get_permission_handlers(
+            ObjectPermissionsConfig, request
+        ):
+            if options.get("bulk"):
+                checks.append(
+                    partial(_bulk_granted, handler, request, instances, pks, action)
+                )
+            else:
+                checks.extend(
+                    partial(handler, request, instance, action=action)
+                    for instance in instances
+                )
+
+        if not self._all_granted(checks):
+            raise PermissionDenied()
+
+        self._check_writable(request, pks)
+
+    def check_bulk_object_permissions(self, request, instances):
+        """
+        Check the object permissions of many objects at once.
+
+        Use this in actions acting on multiple objects, e.g. bulk updates.
+        The objects may be given as a list or a queryset.
+        """
+        for instance in instances:
+            super().check_object_permissions(request, instance)
+        if request.method != "GET":
+            self._check_bulk_object_permissions(request, instances)
+
+    def _check_writable(self, request, pks):
+        writable = self._get_writable_queryset(request)
+        if writable is None:
+            return
+
+        # Compare the primary keys, joins in the handlers may duplicate rows
+        if set(writable.filter(pk__in=pks).values_list("pk", flat=True)) != pks:
+            raise PermissionDenied()
+
+    def _get_writable_queryset(self, request, queryset=None):
+        handlers = self._get_permission_handlers(QuerysetPermissionsConfig, request)
+        if not handlers:
+            return None
+
+        if queryset is None:
+            queryset = self.get_permission_model()._default_manager.all()
+
+        action = getattr(self, "action", None)
+        for handler, _ in handlers:
+            queryset = handler(queryset, request, action=action)
+        return queryset
+
+    def get_writable_queryset(self, queryset=None):
+        """
+        Return the objects of `queryset` the request may modify.
+
+        Only the queryset permissions are applied. Without a queryset, all
+        objects of the permission model are filtered.
+        """
+        writable = self._get_writable_queryset(self.request, queryset)
+        if writable is None:
+            if queryset is None:
+                return self.get_permission_model()._default_manager.all()
+            return queryset
+        return writable
+
+    def annotate_writable(self, queryset, name="can_edit"):
+        """
+        Annotate whether the request may modify the objects of `queryset`.
+
+        The annotation is computed in the same query as the objects, e.g.
+        to render edit controls for a list of objects.
+        """
+        writable = self._get_writable_queryset(self.request)
+        if writable is None:
+            return queryset.annotate(**{name: Value(True)})
+        return queryset.annotate(**{name: Exists(writable.filter(pk=OuterRef("pk")))})
+
+
+class AsyncPermissionViewMixin(PermissionViewMixin):
+    """
+    Variant of the `PermissionViewMixin` for async views, e.g. of adrf.
+
+    The permission and object permission handlers are awaited concurrently:
+    Handlers defined with `async def` run on the event loop, the others in a
+    thread. Like adrf's own permission checks, this is done from the
+    synchronous `check_permissions()` and `check_object_permissions()`.
+    """
+
+    def _get_async_permission_handlers(self, config, request):
+        # The handlers are resolved once per view instance, i.e. per request
+        handlers = self.__dict__.setdefault("_dgap_async_permission_handlers", {})
+        if config not in handlers:
+            handlers[config] = config._async_handlers_for_request(
+                self.get_permission_model(), request
+            )
+        return handlers[config]
+
+    def _check_permissions(self, request):
+        async_to_sync(self._acheck_permissions)(request)
+
+    async def _acheck_permissions(self, request):
+        action = getattr(self, "action", None)
+        granted = await asyncio.gather(
+            *(
+                handler(request, action=action)
+                for handler, _ in self._get_async_permission_handlers(
+                    PermissionsConfig, request
+                )
+            )
+        )
+        if not all(granted):
+            raise PermissionDenied()
+
+    def _check_object_permissions(self, request, instance):
+        async_to_sync(self._acheck_object_permissions)(request, [instance])
+
+    def _check_bulk_object_permissions(self, request, instances):
+        async_to_sync(self._acheck_object_permissions)(request, list(instances))
+
+    async def _acheck_object_permissions(self, request, instances):
+        action = getattr(self, "action", None)
+        pks = {instance.pk for instance in instances}
+
+        async def check_bulk(handler):
+            return pks <= set(await handler(request, instances, action=action))
+
+        checks = []
+        for handler, options in self._get_async_permission_handlers(
+            ObjectPermissionsConfig, request
+        ):
+            if options.get("bulk"):
+                checks.append(check_bulk(handler))
+            else:
+                checks.extend(
+                    handler(request, instance, action=action) for instance in instances
+                )
+
+        if not all(await asyncio.gather(*checks)):
+            raise PermissionDenied()
+
+        await sync_to_async(self._check_writable)(request, pks)
+
 
 class BasePermission:
     def __init__(self, *args, **kwargs):  # pragma: no cover
@@ -78,3 +361,7 @@ class DenyAll:
     @object_permission_for(object)
     def default_object_permission(self, request, instance, *args, **kwargs):
         return False
+
+    @queryset_permission_for(object)
+    def default_queryset_permission(self, queryset, request, *args, **kwargs):
+        return queryset.none()
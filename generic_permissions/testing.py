@@ -0,0 +1,57 @@
+from contextlib import contextmanager
+
+from .instrumentation import VisibilityQueryCounter
+
+"""
+Test helpers to keep the visibility queries of responses in check.
+
+Only the queries run by the visibility related fields and the
+`VisibilitySerializerMixin` are counted, not the ones of the view or the
+serialized rows themselves:
+
+```
+>>> from generic_permissions.testing import assert_visibility_queries
+>>> def test_list(client):
+...     with assert_visibility_queries(max=2):
+...         client.get(reverse("post-list"))
+```
+
+For pytest, the same helper is available as the `dgap_assert_visibility_queries`
+fixture. Make it available in your `conftest.py` with
+`pytest_plugins = ["generic_permissions.testing"]`.
+"""
+
+
+def count_visibility_queries():
+    """Count the visibility queries run in the `with` block.
+
+    Returns a context manager providing the `count` and the `queries`.
+    """
+    return VisibilityQueryCounter()
+
+
+@contextmanager
+def assert_visibility_queries(max):
+    """Assert that at most `max` visibility queries are run in the `with` block."""
+    with count_visibility_queries() as counter:
+        yield counter
+
+    if counter.count > max:
+        queries = "\n".join(
+            f"{i}. {sql}" for i, sql in enumerate(counter.queries, start=1)
+        )
+        raise AssertionError(
+            f"Expected at most {max} visibility queries, but {counter.count} "
+            f"were run:\n{queries}"
+        )
+
+
+try:
+    import pytest
+except ImportError:  # pragma: no cover
+    pass
+else:
+
+    @pytest.fixture
+    def dgap_assert_visibility_queries():
+        return assert_visibility_queries
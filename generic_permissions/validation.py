@@ -1,5 +1,9 @@
 from warnings import warn
 
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import ListSerializer, as_serializer_error
+
 from .config import ValidatorsConfig
 
 """
@@ -37,15 +41,108 @@ class BaseValidator:
         )
 
 
+def _get_validators(model, request):
+    """Return the validators for the given model with options, cheapest first."""
+    validators = ValidatorsConfig._handlers_for_request(model, request)
+    # The sort is stable, so validators of the same cost keep their order
+    return sorted(validators, key=lambda validator: validator[1].get("cost", 0))
+
+
+def _run_validators(validators, data, context, collect_errors):
+    """Run the validators in order and return the validated data.
+
+    The first `ValidationError` stops the validation, unless `collect_errors`
+    is set. Then the remaining validators still run, and all errors are
+    raised together at the end.
+    """
+    errors = {}
+    for method in validators:
+        try:
+            data = method(data, context=context)
+        except ValidationError as exc:
+            if not collect_errors:
+                raise
+            for key, detail in as_serializer_error(exc).items():
+                errors.setdefault(key, []).extend(detail)
+
+    if errors:
+        raise ValidationError(errors)
+    return data
+
+
+def _as_single_validator(method):
+    def validate(data, context):
+        [data] = method([data], context=context)
+        return data
+
+    return validate
+
+
 class ValidatorMixin:
+    # Run all validators and raise their errors together, instead of
+    # stopping at the first error
+    collect_validation_errors = False
+
     def validate(self, *args, **kwargs):
         validated_data = super().validate(*args, **kwargs)
 
-        for method in ValidatorsConfig.get_handlers(
-            self.Meta.model,
+        # Bulk validators are called by the list serializer for all items
+        in_bulk = isinstance(self.parent, ValidatorListSerializerMixin)
+
+        validators = []
+        for method, options in _get_validators(
+            self.Meta.model, self.context.get("request")
         ):
-            validated_data = method(validated_data, context=self.context)
-        return validated_data
+            if not options.get("bulk"):
+                validators.append(method)
+            elif not in_bulk:
+                validators.append(_as_single_validator(method))
+
+        return _run_validators(
+            validators, validated_data, self.context, self.collect_validation_errors
+        )
+
+
+class AsyncValidatorMixin(ValidatorMixin):
+    """Variant of the `ValidatorMixin` for async code.
+
+    `ais_valid()` runs the validation in a thread, so validators may query
+    the database, while validators defined with `async def` are awaited on
+    the event loop.
+    """
+
+    async def ais_valid(self, *, raise_exception=False):
+        return await sync_to_async(self.is_valid)(raise_exception=raise_exception)
+
+
+class ValidatorListSerializerMixin:
+    """Run bulk validators once for all items of a list serializer.
+
+    Validators decorated with `@validator_for(Model, bulk=True)` receive the
+    list of validated data of all items, and return it back. Use this as
+    `list_serializer_class` of serializers with the `ValidatorMixin`.
+    """
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+
+        validators = [
+            method
+            for method, options in _get_validators(
+                self.child.Meta.model, self.context.get("request")
+            )
+            if options.get("bulk")
+        ]
+        return _run_validators(
+            validators,
+            attrs,
+            self.context,
+            getattr(self.child, "collect_validation_errors", False),
+        )
+
+
+class ValidatorListSerializer(ValidatorListSerializerMixin, ListSerializer):
+    pass
 
 
 class PassThrough:
@@ -1,11 +1,37 @@
+import hashlib
+import json
+import operator
+import threading
+from collections import OrderedDict, defaultdict
 from functools import reduce
+from itertools import islice
 from warnings import warn
 
+from asgiref.sync import sync_to_async
+from django.apps import apps
 from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models import Prefetch, prefetch_related_objects
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.db.models.sql.datastructures import Join
+from django.dispatch import receiver
+from django.http import StreamingHttpResponse
+from django.test.signals import setting_changed
+from rest_framework.fields import SkipField
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.relations import MANY_RELATION_KWARGS, ManyRelatedField
-from rest_framework.serializers import PrimaryKeyRelatedField
+from rest_framework.serializers import ListSerializer, PrimaryKeyRelatedField
+from rest_framework.utils.encoders import JSONEncoder
 
-from .config import DGAPConfigManager, VisibilitiesConfig
+from .config import DGAPConfigManager, Lifecycle, VisibilitiesConfig, request_cache
+from .instrumentation import (
+    VisibilityQueryCounter,
+    VisibilityQueryWarning,
+    visibility_region,
+)
 
 """
 Basic visibility classes to be extended by any visibility implementation.
@@ -39,54 +65,501 @@ A custom visibility class could look like this:
 filter_queryset_for = VisibilitiesConfig.decorator
 
 
-def _should_bypass_field(instance, field_name: str) -> bool:
+_ALL_FIELDS = "__all__"
+
+# Model class -> frozenset of bypassed field names, or `_ALL_FIELDS`. Compiled
+# from the `GENERIC_PERMISSIONS_BYPASS_VISIBILITIES` setting
+_bypass_index = {}
+
+
+def compile_bypass_index():
+    """Compile the `GENERIC_PERMISSIONS_BYPASS_VISIBILITIES` setting.
+
+    This runs when the app is ready and whenever the setting changes.
+    """
+    global _bypass_index
+
     bypass_fields_settings = (
         getattr(settings, "GENERIC_PERMISSIONS_BYPASS_VISIBILITIES", {}) or {}
     )
 
-    meta = getattr(instance, "_meta", None) or getattr(instance, "Meta", None)
-    app_label = getattr(meta, "app_label", "")
-    bypass_fields = bypass_fields_settings.get(
-        f"{app_label}.{type(instance).__name__}",
-        [],
+    index = {}
+    for label, bypass_fields in bypass_fields_settings.items():
+        try:
+            model = apps.get_model(label)
+        except (LookupError, ValueError):
+            continue
+        index[model] = (
+            _ALL_FIELDS if bypass_fields == _ALL_FIELDS else frozenset(bypass_fields)
+        )
+
+    _bypass_index = index
+
+
+@receiver(setting_changed)
+def _bypass_setting_changed(setting, **kwargs):
+    if setting == "GENERIC_PERMISSIONS_BYPASS_VISIBILITIES":
+        compile_bypass_index()
+
+
+# (handler class, method name, model, principal key digest) -> the model's default
+# queryset filtered by the handler. Only used for visibility classes that set
+# `compile_filters` and declare `get_principal_key()`, and bounded to the most
+# recently used entries
+_compiled_filters = OrderedDict()
+_compiled_filters_lock = threading.Lock()
+_COMPILED_FILTERS_MAX_SIZE = 1024
+
+
+def clear_compiled_filters(visibility_cls=None):
+    """Forget the filters memoized per principal key.
+
+    Forgets the filters of all visibility classes, or only of the given one.
+    This runs when the app is ready. Call it if the filters of a principal
+    key change, e.g. in a data migration.
+    """
+    with _compiled_filters_lock:
+        if visibility_cls is None:
+            _compiled_filters.clear()
+            return
+
+        for key in [key for key in _compiled_filters if key[0] is visibility_cls]:
+            del _compiled_filters[key]
+
+
+def combine_principal_keys(visibilities, request):
+    """Return the combined principal key of the given visibility instances.
+
+    Visibility classes can declare a `get_principal_key(request)` method
+    returning what their handlers' output fully depends on, e.g. the tenant
+    and the roles of the user. Returns `None` unless all of them do.
+    """
+    keys = []
+    for visibility in visibilities:
+        get_key = getattr(visibility, "get_principal_key", None)
+        key = get_key(request) if get_key is not None else None
+        if key is None:
+            return None
+        keys.append(key)
+    return tuple(keys) or None
+
+
+def _canonical(value):
+    if isinstance(value, dict):
+        return {str(key): _canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted(
+            (_canonical(item) for item in value),
+            key=lambda item: json.dumps(item, sort_keys=True, default=str),
+        )
+    return value
+
+
+def canonical_principal_key(key):
+    """Return the principal key as a canonical JSON string.
+
+    Sets are sorted and tuples become lists, so equal keys give the same
+    string regardless of the iteration order of their sets.
+    """
+    return json.dumps(
+        _canonical(key), sort_keys=True, separators=(",", ":"), default=str
+    )
+
+
+def principal_key_digest(key):
+    """Return the SHA-256 hex digest of the canonical principal key.
+
+    The digest is used to store principal keys, e.g. in cache keys, with a
+    fixed length and without characters the backends may not accept.
+    """
+    return hashlib.sha256(canonical_principal_key(key).encode()).hexdigest()
+
+
+def _is_combinable(queryset):
+    query = queryset.query
+    return not (
+        query.annotations
+        or query.distinct_fields
+        or query.is_sliced
+        or query.combinator
+        or query.values_select
+    )
+
+
+def _is_single_valued(queryset):
+    # Combining filters across multi-valued relations with `&` may join them
+    # differently than chaining the filters would
+    return not any(
+        getattr(join.join_field, "one_to_many", False)
+        or getattr(join.join_field, "many_to_many", False)
+        for join in queryset.query.alias_map.values()
+        if isinstance(join, Join)
+    )
+
+
+def _compiled_filter(handler, model, request):
+    """Return the memoized result of `handler` for the principal of the request.
+
+    Returns `None` if the handler's class doesn't opt in with `compile_filters`
+    and a principal key, or if the result can't be combined with other
+    querysets.
+    """
+    visibility = handler.__self__
+    if not getattr(visibility, "compile_filters", False):
+        return None
+    if isinstance(visibility, Composition):
+        # Compositions are responsible for their own caching
+        return None
+
+    principal_key = combine_principal_keys([visibility], request)
+    if principal_key is None:
+        return None
+
+    # Async handlers called synchronously keep their name, see `_to_sync()`
+    key = (
+        type(visibility),
+        handler.__name__,
+        model,
+        # Principal keys may contain unhashable values, e.g. lists
+        principal_key_digest(principal_key),
     )
+    with _compiled_filters_lock:
+        try:
+            _compiled_filters.move_to_end(key)
+            return _compiled_filters[key]
+        except KeyError:
+            pass
+
+    compiled = handler(model._default_manager.all(), request)
+    if not (_is_combinable(compiled) and _is_single_valued(compiled)):
+        compiled = None
+
+    with _compiled_filters_lock:
+        _compiled_filters[key] = compiled
+        if len(_compiled_filters) > _COMPILED_FILTERS_MAX_SIZE:
+            _compiled_filters.popitem(last=False)
+    return compiled
 
-    if bypass_fields == "__all__":
-        return True
 
-    return field_name in bypass_fields
+def _get_handlers(config, model, request):
+    # The request stores the instances of handler classes with a per-request
+    # lifecycle
+    return [handler for handler, _ in config._handlers_for_request(model, request)]
+
+
+def _apply_handlers(queryset, handlers, request):
+    """Filter the queryset by the given visibility handlers.
+
+    The filters of visibility classes opting in with `compile_filters` are
+    built once per principal key, and then combined with the queryset.
+    """
+    for handler in handlers:
+        compiled = (
+            _compiled_filter(handler, queryset.model, request)
+            if _is_combinable(queryset)
+            else None
+        )
+        if compiled is None:
+            queryset = handler(queryset, request)
+        elif compiled.query.is_empty():
+            queryset = queryset.none()
+        else:
+            if compiled.query.distinct and not queryset.query.distinct:
+                queryset = queryset.distinct()
+            elif queryset.query.distinct and not compiled.query.distinct:
+                compiled = compiled.distinct()
+            queryset = queryset & compiled
+    return queryset
+
+
+def _should_bypass_model_field(model, field_name: str) -> bool:
+    bypass_fields = _bypass_index.get(model, ())
+    return bypass_fields == _ALL_FIELDS or field_name in bypass_fields
+
+
+def _should_bypass_field(instance, field_name: str) -> bool:
+    return _should_bypass_model_field(type(instance), field_name)
+
+
+def _visible_pks(request, model, pks, handlers):
+    """Return the subset of `pks` whose objects of `model` are visible.
+
+    The outcome is cached per model on the request, so each primary key is
+    only checked once per request, no matter how many rows refer to it.
+    """
+    if not handlers:
+        return set(pks)
+
+    known = request_cache(request, "visible_pks").setdefault(model, {})
+    unknown = {pk for pk in pks if pk not in known}
+
+    if unknown:
+        queryset = _apply_handlers(
+            model._default_manager.filter(pk__in=unknown), handlers, request
+        )
+
+        visible = set(queryset.values_list("pk", flat=True))
+        known.update((pk, pk in visible) for pk in unknown)
+
+    return {pk for pk in pks if known[pk]}
 
 
 class VisibilityViewMixin:
+    # Relations (lookups as for `prefetch_related`) to prefetch on read
+    # requests, with the visibilities of the related model already applied
+    visible_prefetch = []
+
+    # Skip the visibility handlers if the queryset is empty. This costs an
+    # additional query per request, so disable it if your handlers are cheap
+    # to build or if the queryset is rarely empty
+    visibility_exists_check = True
+
+    # Number of rows fetched and serialized at once by `get_export_response()`
+    export_chunk_size = 2000
+
     def get_queryset(self):
+        # DRF calls `get_queryset()` several times per request, so the
+        # filtered queryset is memoized on the view for the current request
+        memoized = getattr(self, "_dgap_visible_queryset", None)
+        if memoized is None or memoized[0] is not self.request:
+            queryset, filtered = self._get_visible_queryset()
+            if not filtered:
+                # The handlers were skipped for an empty queryset, which may
+                # not be empty anymore on the next call
+                return queryset
+            memoized = (self.request, queryset)
+            self._dgap_visible_queryset = memoized
+
+        # Return a clone, so callers don't share the result cache
+        return memoized[1].all()
+
+    def invalidate_visible_queryset(self):
+        """Rebuild the filtered queryset on the next call to `get_queryset()`.
+
+        Call this if something the visibility handlers depend on changes
+        during the request.
+        """
+        self._dgap_visible_queryset = None
+
+    def _get_visible_queryset(self):
+        # Return the queryset, and whether it was filtered by the handlers
         queryset = super().get_queryset()
-        handlers = VisibilitiesConfig.get_handlers(queryset.model)
+        handlers = _get_handlers(VisibilitiesConfig, queryset.model, self.request)
 
-        if not handlers or not queryset.exists():
-            return queryset
+        skipped = (
+            bool(handlers) and self.visibility_exists_check and not queryset.exists()
+        )
+        if handlers and not skipped:
+            queryset = _apply_handlers(queryset, handlers, self.request)
 
-        for handler in handlers:
-            queryset = handler(queryset, self.request)
+        if self.visible_prefetch and self.request.method in SAFE_METHODS:
+            queryset = queryset.prefetch_related(
+                *self.get_visible_prefetches(queryset.model)
+            )
+
+        return queryset, not skipped
+
+    def get_visible_prefetches(self, model):
+        """Return `Prefetch` objects for the lookups in `visible_prefetch`.
+
+        The querysets of the prefetches are filtered by the visibilities of
+        the related model. Visibility-aware related fields then serve the
+        prefetched objects without checking them again.
+
+        The prefetches are only used on read requests: When updating, the
+        `VisibilitySerializerMixin` needs to see the hidden relations as well.
+        """
+        prefetches = []
+        for lookup in self.visible_prefetch:
+            related_model = model
+            for field_name in lookup.split(LOOKUP_SEP):
+                related_model = related_model._meta.get_field(field_name).related_model
+
+            queryset = _apply_handlers(
+                related_model._default_manager.all(),
+                _get_handlers(VisibilitiesConfig, related_model, self.request),
+                self.request,
+            )
+
+            # Marker for the related fields. It is kept when Django
+            # clones the queryset to filter it for each instance
+            queryset.query._dgap_visible = True
+            prefetches.append(Prefetch(lookup, queryset=queryset))
+
+        return prefetches
+
+    def get_export_response(self, queryset=None, chunk_size=None):
+        """Stream the visible rows as a JSON array.
+
+        The rows are fetched with `QuerySet.iterator()`, which uses a
+        server-side cursor where the database supports it. They are
+        serialized in chunks of `chunk_size` (`export_chunk_size` by
+        default), so with a `VisibilityListSerializer` the visibility of the
+        related objects is checked once per chunk, and only one chunk is
+        kept in memory. The prefetches of the queryset run per chunk.
+
+        The rows are always encoded as JSON, the renderers of the view are
+        not used.
+        """
+        if queryset is None:
+            queryset = self.filter_queryset(self.get_queryset())
+
+        return StreamingHttpResponse(
+            self._stream_export(queryset, chunk_size or self.export_chunk_size),
+            content_type="application/json",
+        )
+
+    def _stream_export(self, queryset, chunk_size):
+        # `iterator()` ignores the prefetches before Django 4.1, so they are
+        # run on each chunk instead
+        lookups = queryset._prefetch_related_lookups
+        rows = queryset.prefetch_related(None).iterator(chunk_size=chunk_size)
+        separator = "["
+        while chunk := list(islice(rows, chunk_size)):
+            prefetch_related_objects(chunk, *lookups)
+            for row in self.get_serializer(chunk, many=True).data:
+                yield separator + json.dumps(row, cls=JSONEncoder)
+                separator = ","
+
+            # Keep the memory flat, the related objects of other chunks
+            # rarely overlap
+            request_cache(self.request, "visible_pks").clear()
+
+        yield "[]" if separator == "[" else "]"
+
+
+class AsyncVisibilityViewMixin(VisibilityViewMixin):
+    """Variant of the `VisibilityViewMixin` for async views, e.g. of adrf.
+
+    Applying the visibilities may query the database, which isn't allowed on
+    the event loop. So the visible queryset is built in `initial()`, which
+    adrf runs in a thread, and `get_queryset()` returns it from the memo
+    afterwards. Visibility handlers defined with `async def` are awaited on
+    the event loop.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if getattr(self, "action", None) != "create":
+            self.get_queryset()
+
+    async def aget_queryset(self):
+        return await sync_to_async(self.get_queryset)()
+
+
+def _is_prefetched(queryset):
+    # Relations loaded with `prefetch_related` are served from an already
+    # evaluated queryset
+    return getattr(queryset, "_result_cache", None) is not None
+
+
+def _is_visible_queryset(queryset):
+    # Querysets built by `VisibilityViewMixin.get_visible_prefetches`
+    return getattr(queryset.query, "_dgap_visible", False)
+
+
+class _VisibilityFieldMixin:
+    """Visibility metadata of a related field, resolved once on bind.
+
+    Serializers are instantiated per request, but serialize many rows, so
+    the fields only look up what they can't know on bind for each row.
+    """
+
+    # Whether the field bypasses the visibilities, `None` if unknown on bind
+    _bypass_visibility = None
+    # The related model, and the visibility handlers for it
+    _visibility_model = None
+    _visibility_handlers = None
+
+    def _bind_visibility(self, parent, queryset=None):
+        model = getattr(getattr(parent, "Meta", None), "model", None)
+        if model is not None:
+            self._bypass_visibility = _should_bypass_model_field(model, self.field_name)
+
+        if queryset is not None:
+            self._visibility_model = queryset.model
+        else:
+            try:
+                self._visibility_model = model._meta.get_field(
+                    self.source
+                ).related_model
+            except (AttributeError, FieldDoesNotExist):
+                pass
+
+        if self._visibility_model is not None:
+            self._visibility_handlers = _get_handlers(
+                VisibilitiesConfig, self._visibility_model, self.context.get("request")
+            )
+
+    def _bypasses_visibility(self, instance):
+        if self._bypass_visibility is None:
+            return _should_bypass_field(instance, self.field_name)
+        return self._bypass_visibility
+
+    def _get_visibility_handlers(self, model, request):
+        if model is self._visibility_model:
+            return self._visibility_handlers
+        return _get_handlers(VisibilitiesConfig, model, request)
 
-        return queryset
 
+class VisibilityManyRelatedField(_VisibilityFieldMixin, ManyRelatedField):
+    def bind(self, field_name, parent):
+        super().bind(field_name, parent)
+        self._bind_visibility(parent)
 
-class VisibilityManyRelatedField(ManyRelatedField):
+    @visibility_region
     def get_attribute(self, instance):
         queryset = super().get_attribute(instance)
-        handlers = VisibilitiesConfig.get_handlers(queryset.model)
 
-        if (
-            not handlers
-            or _should_bypass_field(instance, self.field_name)
-            or not queryset.exists()
-        ):
+        if self._bypasses_visibility(instance):
             return queryset
 
-        for handler in handlers:
-            queryset = handler(queryset, self.parent._context["request"])
+        request = self.parent._context["request"]
 
-        return queryset
+        if _is_prefetched(queryset):
+            if _is_visible_queryset(queryset):
+                return queryset
+
+            # Filter the prefetched objects instead of querying them again
+            visible_pks = _visible_pks(
+                request,
+                queryset.model,
+                {obj.pk for obj in queryset},
+                self._get_visibility_handlers(queryset.model, request),
+            )
+            return [obj for obj in queryset if obj.pk in visible_pks]
+
+        handlers = self._get_visibility_handlers(queryset.model, request)
+
+        if not handlers or not queryset.exists():
+            return queryset
+
+        return _apply_handlers(queryset, handlers, request)
+
+    @visibility_region
+    def check_visibility_in_bulk(self, instances):
+        """Check the visibility of the prefetched relations of many instances.
+
+        The results are cached on the request, so the following calls to
+        `get_attribute` for these instances don't run any queries. Relations
+        that were not prefetched are still checked per instance.
+        """
+        pks_by_model = defaultdict(set)
+        for instance in instances:
+            if self._bypasses_visibility(instance):
+                continue
+
+            queryset = super().get_attribute(instance)
+            if _is_prefetched(queryset) and not _is_visible_queryset(queryset):
+                pks_by_model[queryset.model].update(obj.pk for obj in queryset)
+
+        request = self.parent._context["request"]
+        for model, pks in pks_by_model.items():
+            _visible_pks(
+                request, model, pks, self._get_visibility_handlers(model, request)
+            )
 
 
 class VisibilitySerializerMixin:
@@ -103,6 +576,7 @@ class VisibilitySerializerMixin:
     to ensure validations are performed first.
     """
 
+    @visibility_region
     def validate(self, *args, **kwargs):
         validated_data = super().validate(*args, **kwargs)
 
@@ -119,9 +593,13 @@ class VisibilitySerializerMixin:
                 continue
 
             # Find the relations which the request can include.
+            request = self.context["request"]
             queryset = getattr(self.instance, key).all()
-            for handler in VisibilitiesConfig.get_handlers(queryset.model):
-                queryset = handler(queryset, self.context["request"])
+            queryset = _apply_handlers(
+                queryset,
+                field._get_visibility_handlers(queryset.model, request),
+                request,
+            )
 
             # Add remaining relations which can not be included in the request.
             validated_data[key] += getattr(self.instance, key).exclude(pk__in=queryset)
@@ -129,7 +607,7 @@ class VisibilitySerializerMixin:
         return validated_data
 
 
-class VisibilityRelatedFieldMixin:
+class VisibilityRelatedFieldMixin(_VisibilityFieldMixin):
     @classmethod
     def many_init(cls, *args, **kwargs):
         # ManyToManyField
@@ -140,28 +618,63 @@ class VisibilityRelatedFieldMixin:
 
         return VisibilityManyRelatedField(**list_kwargs)
 
+    @visibility_region
     def get_attribute(self, instance):
         # ForeignKey
         model_instance = super().get_attribute(instance)
 
-        if _should_bypass_field(instance, self.field_name):
+        if self._bypasses_visibility(instance):
             return model_instance
 
-        if model_instance.pk is None:
+        if getattr(model_instance, "pk", None) is None:
             return None
 
-        # read only fields don't have queryset, infer it from the model
-        queryset = self.queryset or type(instance).objects
-        queryset = queryset.filter(pk=model_instance.pk)
-
-        for handler in VisibilitiesConfig.get_handlers(queryset.model):
-            queryset = handler(queryset, self.parent._context["request"])
-
-        if not queryset.filter(pk=model_instance.pk).exists():
+        request = self.parent._context["request"]
+        model = self._get_visibility_model(instance)
+        visible_pks = _visible_pks(
+            request,
+            model,
+            [model_instance.pk],
+            self._get_visibility_handlers(model, request),
+        )
+        if model_instance.pk not in visible_pks:
             return None
 
         return model_instance
 
+    def _get_visibility_model(self, instance):
+        # The related model is resolved on bind from the queryset, or for
+        # read only fields from the serializer's model. Fall back to the
+        # model of the instance if neither is available
+        return self._visibility_model or type(instance)
+
+    @visibility_region
+    def check_visibility_in_bulk(self, instances):
+        """Check the visibility of the related objects of many instances at once.
+
+        The results are cached on the request, so the following calls to
+        `get_attribute` for these instances don't run any queries.
+        """
+        pks_by_model = defaultdict(set)
+        for instance in instances:
+            if self._bypasses_visibility(instance):
+                continue
+
+            try:
+                model_instance = super().get_attribute(instance)
+            except SkipField:
+                continue
+
+            pk = getattr(model_instance, "pk", None)
+            if pk is not None:
+                pks_by_model[self._get_visibility_model(instance)].add(pk)
+
+        request = self.parent._context["request"]
+        for model, pks in pks_by_model.items():
+            _visible_pks(
+                request, model, pks, self._get_visibility_handlers(model, request)
+            )
+
     def bind(self, field_name, parent):
         if isinstance(parent, VisibilityManyRelatedField):
             return super().bind(field_name, parent)
@@ -170,7 +683,57 @@ class VisibilityRelatedFieldMixin:
             raise RuntimeWarning(
                 f"To avoid data loss, use VisibilitySerializerMixin in {type(parent).__name__}"
             )
-        return super().bind(field_name, parent)
+        super().bind(field_name, parent)
+        self._bind_visibility(parent, self.queryset)
+
+
+class VisibilityListSerializerMixin:
+    """
+    Mixin for list serializers to check the visibility of relations in bulk.
+
+    Before serializing the rows, the related objects of all fields using
+    the `VisibilityRelatedFieldMixin` are collected and checked with one
+    query per field, instead of one query per row and field. For many
+    related fields, this only applies to prefetched relations.
+
+    With the `GENERIC_PERMISSIONS_DETECT_VISIBILITY_N_PLUS_ONE` setting, a
+    `VisibilityQueryWarning` is issued if visibility queries are still run
+    while serializing the rows.
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        instances = list(iterable)
+
+        for field in self.child.fields.values():
+            if isinstance(field, _VisibilityFieldMixin) and not field.write_only:
+                field.check_visibility_in_bulk(instances)
+
+        if not getattr(
+            settings, "GENERIC_PERMISSIONS_DETECT_VISIBILITY_N_PLUS_ONE", False
+        ):
+            return super().to_representation(instances)
+
+        with VisibilityQueryCounter() as counter:
+            representation = super().to_representation(instances)
+
+        if counter.count and len(instances) > 1:
+            warn(
+                VisibilityQueryWarning(
+                    f"{counter.count} visibility queries were run while "
+                    f"serializing {len(instances)} rows of "
+                    f"{type(self.child).__name__}. Prefetch the many related "
+                    "fields, e.g. with `visible_prefetch` on the view."
+                ),
+                stacklevel=2,
+            )
+        return representation
+
+
+class VisibilityListSerializer(VisibilityListSerializerMixin, ListSerializer):
+    """Visibility-aware replacement for DRF ListSerializer."""
+
+    pass
 
 
 class VisibilityPrimaryKeyRelatedField(
@@ -226,9 +789,16 @@ class Any:
     pass
 
 
-class Union:
-    """Union result of a list of configured visibility classes."""
+class Composition:
+    """Base for visibilities composed of a list of configured visibility classes.
 
+    The configured classes can declare a `visibility_cost` (0 by default).
+    Their handlers are evaluated cheapest first, so the composition can
+    skip the expensive ones once the result is decided.
+    """
+
+    # The sub-visibilities are registered on instantiation, so only do it once
+    handler_lifecycle = Lifecycle.SINGLETON
     visibility_classes = []
 
     def __init__(self):
@@ -236,11 +806,169 @@ class Union:
         for cls in self.visibility_classes:
             self._config.register_handler_class(cls)
 
+    def get_handlers(self, model, request):
+        """Return the handlers of the configured classes, cheapest first."""
+        return sorted(
+            _get_handlers(self._config, model, request),
+            key=lambda handler: getattr(handler.__self__, "visibility_cost", 0),
+        )
+
+    def get_principal_key(self, request):
+        """Return the combined principal key of the configured classes.
+
+        This is `None` unless all of them declare `get_principal_key()`.
+        """
+        return combine_principal_keys(
+            (
+                self._config._get_instance(cls, request, (), {})
+                for cls in self.visibility_classes
+            ),
+            request,
+        )
+
+
+class Union(Composition):
+    """Union result of a list of configured visibility classes.
+
+    Visibility classes that only filter the given queryset can declare
+    `pure_filter = True`. Their filters are combined with OR in a single
+    WHERE clause. Only the results of the other classes are merged with a
+    (usually much slower) UNION subquery.
+
+    If a class returns the given queryset unchanged, everything is visible
+    and the remaining classes are skipped.
+    """
+
+    @filter_queryset_for(object)
+    def filter_queryset(self, queryset, request):
+        pure_filters, querysets_to_merge = [], []
+        for handler in self.get_handlers(queryset.model, request):
+            result = handler(queryset, request)
+            if result is queryset:
+                return queryset
+            if result.query.is_empty():
+                continue
+            if getattr(handler.__self__, "pure_filter", False):
+                pure_filters.append(result)
+            else:
+                querysets_to_merge.append(result)
+
+        if querysets_to_merge:
+            union_qs = reduce(
+                lambda a, b: a.union(b), querysets_to_merge, queryset.none()
+            )
+            pure_filters.append(queryset.filter(pk__in=union_qs.values("pk")))
+
+        # Distinct and non-distinct querysets can't be combined
+        if any(result.query.distinct for result in pure_filters):
+            pure_filters = [result.distinct() for result in pure_filters]
+
+        return reduce(operator.or_, pure_filters, queryset.none())
+
+
+class Intersection(Composition):
+    """Intersection result of a list of configured visibility classes.
+
+    The classes are applied one after the other, each one filtering the
+    result of the previous one. As soon as one of them returns
+    `queryset.none()`, the remaining classes are skipped.
+    """
+
     @filter_queryset_for(object)
     def filter_queryset(self, queryset, request):
-        handlers = self._config.get_handlers(queryset.model)
-        querysets_to_merge = [handler(queryset, request) for handler in handlers]
+        for handler in self.get_handlers(queryset.model, request):
+            queryset = handler(queryset, request)
+            if queryset.query.is_empty():
+                break
+
+        return queryset
+
+
+class Cached(Composition):
+    """Cache the result of a list of configured visibility classes.
+
+    The primary keys of the objects visible through the configured classes
+    are stored in the Django cache, per model and cache key of the request
+    (the user by default). Use this for visibilities that only depend on
+    the user, and that are expensive to compute.
+
+    If all configured classes declare a `get_principal_key()`, the entries
+    are shared by the users with the same principal key. The cache keys
+    contain the digest of the cache key of the request, see
+    `principal_key_digest()`.
+
+    Cached entries expire after `cache_timeout` seconds. Bump the
+    `cache_version` whenever the configured classes change. Changes to any
+    of the models in `invalidate_on` invalidate all entries right away.
+    """
+
+    cache_alias = "default"
+    cache_timeout = 300
+    cache_version = 1
+    invalidate_on = []
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for model in cls.invalidate_on:
+            for signal in post_save, post_delete:
+                signal.connect(cls._invalidate_receiver, sender=model, weak=False)
+        if cls.invalidate_on:
+            m2m_changed.connect(cls._invalidate_receiver, weak=False)
+
+    @classmethod
+    def _invalidate_receiver(cls, sender, instance, **kwargs):
+        if kwargs.get("action", "post_").startswith("pre_"):
+            return
+
+        models = {sender, type(instance), kwargs.get("model")}
+        if any(model in cls.invalidate_on for model in models):
+            cls.invalidate()
+
+    @classmethod
+    def _generation_key(cls):
+        return f"dgap:cached:{cls.__module__}.{cls.__qualname__}:generation"
+
+    @classmethod
+    def invalidate(cls):
+        """Invalidate all cached entries of this class."""
+        cache = caches[cls.cache_alias]
+        try:
+            cache.incr(cls._generation_key())
+        except ValueError:
+            # No generation yet, so nothing is cached either
+            pass
+
+    def get_cache_key(self, request):
+        """Return what the cached visibility depends on, besides the model.
+
+        This is the principal key of the configured classes if they all
+        declare one, so users with the same key share the cached entries.
+        """
+        principal_key = self.get_principal_key(request)
+        return request.user.pk if principal_key is None else principal_key
+
+    @filter_queryset_for(object)
+    def filter_queryset(self, queryset, request):
+        handlers = self.get_handlers(queryset.model, request)
+        if not handlers:
+            return queryset
+
+        cache = caches[self.cache_alias]
+        generation_key = self._generation_key()
+        generation = cache.get_or_set(generation_key, 0, timeout=None)
+        key = (
+            f"dgap:cached:{type(self).__module__}.{type(self).__qualname__}"
+            f":{queryset.model._meta.label}"
+            f":{principal_key_digest(self.get_cache_key(request))}"
+            f":v{self.cache_version}:g{generation}"
+        )
 
-        union_qs = reduce(lambda a, b: a.union(b), querysets_to_merge, queryset.none())
+        pks = cache.get(key)
+        if pks is None:
+            visible = queryset.model._default_manager.all()
+            for handler in handlers:
+                visible = handler(visible, request)
+            pks = list(visible.values_list("pk", flat=True))
+            cache.set(key, pks, self.cache_timeout)
 
-        return queryset.filter(pk__in=union_qs.values("pk"))
+        return queryset.filter(pk__in=pks)
@@ -4,6 +4,8 @@ import pytest
 from django.apps import apps
 from rest_framework.test import APIClient
 
+pytest_plugins = ["generic_permissions.testing"]
+
 User = namedtuple("User", "username")
 
 
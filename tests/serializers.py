@@ -2,6 +2,7 @@ from rest_framework import serializers
 
 from generic_permissions.validation import ValidatorMixin
 from generic_permissions.visibilities import (
+    VisibilityListSerializer,
     VisibilityPrimaryKeyRelatedField,
     VisibilitySerializerMixin,
 )
@@ -22,6 +23,11 @@ class TestModel1Serializer(
         fields = "__all__"
 
 
+class BulkTestModel1Serializer(TestModel1Serializer):
+    class Meta(TestModel1Serializer.Meta):
+        list_serializer_class = VisibilityListSerializer
+
+
 class TestModel2Serializer(ValidatorMixin, serializers.ModelSerializer):
     class Meta:
         model = models.Model2
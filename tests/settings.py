@@ -5,6 +5,7 @@ DATABASES = {
 INSTALLED_APPS = (
     "tests",
     "generic_permissions.apps.GenericPermissionsConfig",
+    "generic_permissions.contrib.materialization.apps.MaterializationConfig",
 )
 
 GENERIC_PERMISSIONS_PERMISSION_CLASSES = ["generic_permissions.permissions.AllowAny"]
@@ -0,0 +1,155 @@
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.exceptions import ImproperlyConfigured
+
+from generic_permissions.config import Lifecycle, VisibilitiesConfig, request_cache
+from generic_permissions.visibilities import filter_queryset_for
+
+from .models import BaseModel, Model1, Model2
+
+
+def test_handler_resolution_cache():
+    class BaseVisibility:
+        @filter_queryset_for(BaseModel)
+        def filter_queryset_for_all(self, queryset, request):  # pragma: no cover
+            return queryset
+
+    class Model1Visibility:
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):  # pragma: no cover
+            return queryset
+
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(BaseVisibility)
+
+    resolved = VisibilitiesConfig._resolve(Model1)
+    assert resolved == ((BaseVisibility, "filter_queryset_for_all"),)
+    # Repeated lookups are served from the resolution table
+    assert VisibilitiesConfig._resolve(Model1) is resolved
+
+    # Registering a handler class invalidates the table
+    VisibilitiesConfig.register_handler_class(Model1Visibility)
+    assert VisibilitiesConfig._resolve(Model1) == (
+        (BaseVisibility, "filter_queryset_for_all"),
+        (Model1Visibility, "filter_queryset_for_model1"),
+    )
+    assert VisibilitiesConfig._resolve(Model2) == (
+        (BaseVisibility, "filter_queryset_for_all"),
+    )
+
+    # And so does clearing the handlers
+    VisibilitiesConfig.clear_handlers()
+    assert VisibilitiesConfig._resolve(Model1) == ()
+
+
+@pytest.mark.parametrize(
+    "lifecycle,expected_instances",
+    [
+        (None, 4),
+        (Lifecycle.PER_CALL, 4),
+        (Lifecycle.PER_REQUEST, 2),
+        (Lifecycle.SINGLETON, 1),
+    ],
+)
+def test_handler_lifecycle(rf, lifecycle, expected_instances):
+    instances = []
+
+    class CountingVisibility:
+        def __init__(self):
+            instances.append(self)
+
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):  # pragma: no cover
+            return queryset
+
+    if lifecycle:
+        CountingVisibility.handler_lifecycle = lifecycle
+
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(CountingVisibility)
+
+    for request in rf.get("/"), rf.get("/"):
+        for _ in range(2):
+            VisibilitiesConfig._handlers_for_request(Model1, request)
+
+    assert len(instances) == expected_instances
+
+    # Clearing the handlers also drops the singletons
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(CountingVisibility)
+    VisibilitiesConfig.get_handlers(Model1)
+    assert len(instances) == expected_instances + 1
+
+
+def test_handler_init_kwargs(rf):
+    class RequestVisibility:
+        def __init__(self, request=None):
+            self.request = request
+
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):  # pragma: no cover
+            return queryset
+
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(RequestVisibility)
+
+    # All kwargs, including `request`, are passed to the handler class
+    request = rf.get("/")
+    [handler] = VisibilitiesConfig.get_handlers(Model1, request=request)
+    assert handler.__self__.request is request
+
+    # The request used to store per-request instances is not passed
+    [(handler, _)] = VisibilitiesConfig._handlers_for_request(Model1, request)
+    assert handler.__self__.request is None
+
+
+def test_handler_lifecycle_invalid():
+    class InvalidVisibility:
+        handler_lifecycle = "forever"
+
+    with pytest.raises(ImproperlyConfigured):
+        VisibilitiesConfig.register_handler_class(InvalidVisibility)
+
+
+def test_request_cache(rf):
+    request = rf.get("/")
+    request_cache(request, "foo")["bar"] = 1
+
+    assert request_cache(request, "foo") == {"bar": 1}
+    assert request_cache(request, "baz") == {}
+    assert request_cache(None, "foo") == {}
+
+
+def test_async_handlers(rf):
+    class AsyncVisibility:
+        @filter_queryset_for(Model1)
+        async def filter_queryset_for_model1(self, queryset, request):
+            return queryset.none()
+
+    class SyncVisibility:
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):
+            return queryset.all()
+
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(AsyncVisibility)
+    VisibilitiesConfig.register_handler_class(SyncVisibility)
+    request = rf.get("/")
+    queryset = Model1.objects.all()
+
+    # Async handlers can be called from sync code
+    async_handler, sync_handler = VisibilitiesConfig.get_handlers(Model1)
+    assert async_handler(queryset, request).query.is_empty()
+    assert isinstance(async_handler.__self__, AsyncVisibility)
+    assert not sync_handler(queryset, request).query.is_empty()
+
+    # And all handlers can be awaited from async code
+    async def filter_queryset():
+        results = []
+        for handler in VisibilitiesConfig.get_async_handlers(Model1):
+            results.append(await handler(queryset, request))
+        return results
+
+    async_result, sync_result = async_to_sync(filter_queryset)()
+    assert async_result.query.is_empty()
+    assert not sync_result.query.is_empty()
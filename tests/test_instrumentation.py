@@ -0,0 +1,147 @@
+import logging
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.urls import reverse
+
+from generic_permissions.config import VisibilitiesConfig
+from generic_permissions.instrumentation import (
+    InstrumentedHandler,
+    handler_executed,
+    registry_sink,
+)
+from generic_permissions.visibilities import Union, filter_queryset_for
+
+from .models import Model1, Model2
+
+SINKS = [
+    "generic_permissions.instrumentation.log_sink",
+    "generic_permissions.instrumentation.signal_sink",
+    "generic_permissions.instrumentation.registry_sink",
+]
+
+
+class QueryingVisibility:
+    @filter_queryset_for(Model1)
+    def filter_queryset_for_model1(self, queryset, request):
+        pks = list(Model2.objects.values_list("pk", flat=True))
+        return queryset.filter(model2__in=pks)
+
+
+@pytest.fixture
+def instrumentation(settings):
+    settings.GENERIC_PERMISSIONS_INSTRUMENTATION_SINKS = SINKS
+    registry_sink.reset()
+    yield
+    registry_sink.reset()
+
+
+def test_instrumentation(db, admin_client, caplog, instrumentation, mocker):
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(QueryingVisibility)
+    Model1.objects.create(text="foo", model2=Model2.objects.create())
+
+    receiver = mocker.Mock()
+    handler_executed.connect(receiver)
+
+    with caplog.at_level(logging.DEBUG, logger="generic_permissions"):
+        response = admin_client.get(reverse("model1-list"))
+    assert response.status_code == 200
+
+    key = (
+        "visibility",
+        "tests.Model1",
+        f"{__name__}.QueryingVisibility.filter_queryset_for_model1",
+    )
+    stats = registry_sink.get_stats()[key]
+    assert stats["calls"] == 1
+    assert stats["queries"] == 1
+    assert stats["duration"] > 0
+
+    execution = receiver.call_args.kwargs["execution"]
+    assert receiver.call_args.kwargs["sender"] is Model1
+    assert execution.handler == key[2]
+    assert "visibility handler" in caplog.text
+
+    handler_executed.disconnect(receiver)
+
+
+def test_instrumentation_error(db, rf, instrumentation):
+    class FailingVisibility:
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):
+            raise ValueError()
+
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(FailingVisibility)
+
+    [handler] = VisibilitiesConfig.get_handlers(Model1)
+    # The wrapper passes attributes through to the handler
+    assert isinstance(handler, InstrumentedHandler)
+    assert isinstance(handler.__self__, FailingVisibility)
+
+    with pytest.raises(ValueError):
+        handler(Model1.objects.all(), rf.get("/"))
+
+    # Failing calls are recorded too
+    [stats] = registry_sink.get_stats().values()
+    assert stats["calls"] == 1
+
+
+def test_instrumentation_disabled():
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(QueryingVisibility)
+
+    [handler] = VisibilitiesConfig.get_handlers(Model1)
+    assert not isinstance(handler, InstrumentedHandler)
+
+
+def test_instrumentation_async(db, rf, instrumentation):
+    class AsyncVisibility:
+        @filter_queryset_for(Model1)
+        async def filter_queryset_for_model1(self, queryset, request):
+            return queryset
+
+    class SyncVisibility:
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):
+            return queryset
+
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(AsyncVisibility)
+    VisibilitiesConfig.register_handler_class(SyncVisibility)
+
+    async def filter_queryset():
+        for handler in VisibilitiesConfig.get_async_handlers(Model1):
+            await handler(Model1.objects.all(), rf.get("/"))
+
+    async_to_sync(filter_queryset)()
+
+    stats = registry_sink.get_stats()
+    assert {key[2].rsplit(".", 2)[-2] for key in stats} == {
+        "AsyncVisibility",
+        "SyncVisibility",
+    }
+    assert all(value["calls"] == 1 for value in stats.values())
+
+
+def test_instrumentation_async_handler_sync_call(db, rf, instrumentation):
+    class AsyncVisibility:
+        @filter_queryset_for(Model1)
+        async def filter_queryset_for_model1(self, queryset, request):
+            return queryset
+
+    class ConfiguredUnion(Union):
+        visibility_classes = [AsyncVisibility]
+
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(AsyncVisibility)
+
+    # Async handlers are called synchronously by the sync code paths
+    [handler] = VisibilitiesConfig.get_handlers(Model1)
+    handler(Model1.objects.all(), rf.get("/"))
+    ConfiguredUnion().filter_queryset(Model1.objects.all(), rf.get("/"))
+
+    [(key, stats)] = registry_sink.get_stats().items()
+    assert key[2].endswith("AsyncVisibility.filter_queryset_for_model1")
+    assert stats["calls"] == 2
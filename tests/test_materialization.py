@@ -0,0 +1,324 @@
+from collections import namedtuple
+
+import pytest
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.urls import reverse
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from generic_permissions.config import VisibilitiesConfig
+from generic_permissions.contrib.materialization.models import (
+    MaterializedPrincipal,
+    MaterializedVisibility,
+)
+from generic_permissions.contrib.materialization.visibilities import Materialized
+from generic_permissions.visibilities import filter_queryset_for, principal_key_digest
+
+from .conftest import User
+from .models import Model1, Model2
+
+
+@pytest.fixture
+def disconnect():
+    """Disconnect the signal receivers of the materializations after the test.
+
+    The receivers are connected with strong references, so they would keep
+    refreshing the rows in unrelated tests otherwise.
+    """
+    classes = []
+    yield classes.append
+
+    for cls in classes:
+        for model in cls._dependency_models():
+            post_save.disconnect(cls._saved_receiver, sender=model)
+            post_delete.disconnect(cls._deleted_receiver, sender=model)
+        m2m_changed.disconnect(cls._m2m_changed_receiver)
+
+
+class Model1Visibility:
+    @filter_queryset_for(Model1)
+    def filter_queryset_for_model1(self, queryset, request):
+        return self.visibility(queryset, request)
+
+    @classmethod
+    def visibility(cls, queryset, request):
+        if request.user.username == "admin":
+            return queryset
+        return queryset.filter(many__text="visible")
+
+
+@pytest.mark.parametrize("incremental", [True, False])
+def test_materialized_visibility(
+    db, admin_client, client, mocker, disconnect, incremental
+):
+    class Materialization(Materialized):
+        visibility_classes = [Model1Visibility]
+        depends_on = [Model1, Model2]
+
+        def get_principal_key(self, request):
+            return request.user.username
+
+        def get_principal_request(self, principal_key):
+            if not incremental:
+                return super().get_principal_request(principal_key)
+            request = Request(APIRequestFactory().get("/"))
+            request.user = User(username=principal_key)
+            return request
+
+    disconnect(Materialization)
+    spy = mocker.spy(Model1Visibility, "visibility")
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(Materialization)
+
+    visible = Model2.objects.create(text="visible")
+    m1 = Model1.objects.create(text="m1")
+    m1.many.add(visible)
+    m2 = Model1.objects.create(text="m2")
+    url = reverse("model1-list")
+
+    def get_texts(client):
+        return sorted(row["text"] for row in client.get(url).json())
+
+    assert get_texts(client) == ["m1"]
+    assert get_texts(admin_client) == ["m1", "m2"]
+    assert spy.call_count == 2
+    assert MaterializedPrincipal.objects.count() == 2
+
+    # Subsequent requests are served from the table
+    assert get_texts(client) == ["m1"]
+    assert get_texts(admin_client) == ["m1", "m2"]
+    assert spy.call_count == 2
+
+    # Models without handlers are not materialized
+    assert len(client.get(reverse("model2-list")).json()) == 1
+    assert MaterializedPrincipal.objects.count() == 2
+
+    # Changes to the materialized objects are refreshed, either right away
+    # or on the next request
+    m2.many.add(visible)
+    assert get_texts(client) == ["m1", "m2"]
+    m3 = Model1.objects.create(text="m3")
+    assert get_texts(admin_client) == ["m1", "m2", "m3"]
+    visible.model1s_many.add(m3)
+    assert get_texts(client) == ["m1", "m2", "m3"]
+    m1.many.clear()
+    assert get_texts(client) == ["m2", "m3"]
+    assert spy.call_count == (10 if incremental else 6)
+
+    # Deleted objects are removed right away
+    m3.delete()
+    assert get_texts(client) == ["m2"]
+    assert get_texts(admin_client) == ["m1", "m2"]
+    assert spy.call_count == (10 if incremental else 7)
+    assert not MaterializedVisibility.objects.filter(object_pk=str(m3.pk)).exists()
+
+    # Changes to other dependencies drop all rows
+    visible.text = "hidden"
+    visible.save()
+    assert get_texts(client) == []
+    assert spy.call_count == (11 if incremental else 8)
+
+
+def test_materialized_visibility_other_models(db, rf, disconnect):
+    class Model2Visibility:
+        @filter_queryset_for(Model2)
+        def filter_queryset_for_model2(self, queryset, request):
+            return queryset.exclude(text="hidden")
+
+    class Materialization(Materialized):
+        visibility_classes = [Model1Visibility, Model2Visibility]
+        depends_on = {Model1: [Model2], Model2: []}
+
+    disconnect(Materialization)
+    request = rf.get("/")
+    request.user = namedtuple("User", "pk username")(pk=1, username="user")
+    materialized = Materialization()
+
+    visible = Model2.objects.create(text="visible")
+    other = Model2.objects.create(text="other")
+    m1 = Model1.objects.create(text="m1")
+    m1.many.add(visible)
+
+    def filter_queryset(model):
+        return set(materialized.filter_queryset(model.objects.all(), request))
+
+    def materialized_models():
+        return set(MaterializedPrincipal.objects.values_list("model_label", flat=True))
+
+    assert filter_queryset(Model1) == {m1}
+    assert filter_queryset(Model2) == {visible, other}
+    assert set(
+        MaterializedPrincipal.objects.values_list("principal_key", "model_label")
+    ) == {
+        (principal_key_digest(1), "tests.Model1"),
+        (principal_key_digest(1), "tests.Model2"),
+    }
+
+    # Without requests for the principals, changes to a materialized model
+    # drop its own rows, and those of the models depending on it
+    Model1.objects.create(text="m2")
+    assert materialized_models() == {"tests.Model2"}
+    assert filter_queryset(Model1) == {m1}
+    visible.save()
+    assert not MaterializedPrincipal.objects.exists()
+    assert not MaterializedVisibility.objects.exists()
+
+    # Deleted objects are removed from the rows of their model
+    assert filter_queryset(Model2) == {visible, other}
+    other.delete()
+    assert materialized_models() == {"tests.Model2"}
+    assert set(MaterializedVisibility.objects.values_list("object_pk", flat=True)) == {
+        str(visible.pk)
+    }
+
+    # Clearing a relation drops the rows of the objects on the other side
+    assert filter_queryset(Model1) == {m1}
+    visible.model1s_many.clear()
+    assert not MaterializedPrincipal.objects.exists()
+    assert filter_queryset(Model1) == set()
+
+
+def test_materialized_visibility_affected_objects(db, client, mocker, disconnect):
+    class Materialization(Materialized):
+        visibility_classes = [Model1Visibility]
+        depends_on = {Model1: [Model2]}
+
+        def get_principal_key(self, request):
+            return request.user.username
+
+        def get_principal_request(self, principal_key):
+            request = Request(APIRequestFactory().get("/"))
+            request.user = User(username=principal_key)
+            return request
+
+        def get_affected_objects(self, model, changed_model, changed_objects):
+            return model.objects.filter(many__in=changed_objects).values_list(
+                "pk", flat=True
+            )
+
+    disconnect(Materialization)
+    spy = mocker.spy(Model1Visibility, "visibility")
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(Materialization)
+
+    visible = Model2.objects.create(text="visible")
+    Model1.objects.create(text="m1").many.add(visible)
+    Model1.objects.create(text="m2").many.add(Model2.objects.create(text="visible"))
+
+    def get_texts():
+        return sorted(row["text"] for row in client.get(reverse("model1-list")).json())
+
+    assert get_texts() == ["m1", "m2"]
+    assert spy.call_count == 1
+
+    # Only the objects affected by the change are evaluated again
+    visible.text = "hidden"
+    visible.save()
+    assert spy.call_count == 2
+    assert spy.spy_return_list[-1].count() == 0
+    assert get_texts() == ["m2"]
+    assert spy.call_count == 2
+
+    # Changes that affect no objects are not evaluated at all
+    Model2.objects.create(text="visible")
+    assert spy.call_count == 2
+
+
+def test_materialized_visibility_ignores_unrelated_signals(db, mocker, disconnect):
+    class Materialization(Materialized):
+        visibility_classes = [Model1Visibility]
+        depends_on = [Model2]
+
+    disconnect(Materialization)
+    reset = mocker.spy(Materialization, "reset")
+
+    model1 = Model1.objects.create(text="m1")
+    for action in ["pre_add", "post_add"]:
+        Materialization._m2m_changed_receiver(
+            sender=Model1.many.through,
+            instance=model1,
+            action=action,
+            model=Model1 if action == "post_add" else Model2,
+            pk_set={model1.pk},
+        )
+    assert reset.call_count == 0
+
+
+def test_materialized_visibility_intermediate_model(db, rf, mocker, disconnect):
+    class Materialization(Materialized):
+        visibility_classes = [Model1Visibility]
+        depends_on = [Model1.many.through]
+
+    disconnect(Materialization)
+    assert Materialization._receiver_instance() is Materialization._receiver_instance()
+
+    request = rf.get("/")
+    request.user = namedtuple("User", "pk username")(pk=1, username="user")
+    model1 = Model1.objects.create(text="m1")
+    Materialization().filter_queryset(Model1.objects.all(), request)
+    assert MaterializedPrincipal.objects.exists()
+
+    # Changes to the relation drop the rows of the models depending on it
+    model1.many.add(Model2.objects.create(text="visible"))
+    assert not MaterializedPrincipal.objects.exists()
+
+
+def test_materialized_visibility_defaults(db):
+    class Materialization(Materialized):
+        pass
+
+    request = Request(APIRequestFactory().get("/"))
+    request.user = namedtuple("User", "pk")(pk=3)
+    materialized = Materialization()
+    assert materialized.get_principal_key(request) == 3
+    assert materialized.get_principal_request(3) is None
+
+    class RoleVisibility(Model1Visibility):
+        def get_principal_key(self, request):
+            return "role"
+
+    # The principal keys of the configured classes are used, if all declare one
+    class RoleMaterialization(Materialized):
+        visibility_classes = [RoleVisibility]
+
+    assert RoleMaterialization().get_principal_key(request) == ("role",)
+
+    # Without handlers, nothing is materialized
+    assert materialized.filter_queryset(Model1.objects.all(), request).exists() is False
+    assert not MaterializedPrincipal.objects.exists()
+
+
+def test_materialized_visibility_set_principal_key(db, rf, disconnect):
+    class RolesVisibility(Model1Visibility):
+        def get_principal_key(self, request):
+            return frozenset(request.user.username.split(","))
+
+    principal_keys = []
+
+    class Materialization(Materialized):
+        visibility_classes = [RolesVisibility]
+        depends_on = [Model1]
+
+        def get_principal_request(self, principal_key):
+            principal_keys.append(principal_key)
+            request = rf.get("/")
+            request.user = User(username=",".join(*principal_key))
+            return request
+
+    disconnect(Materialization)
+    materialized = Materialization()
+    for username in ["b,a", "a,b"]:
+        request = rf.get("/")
+        request.user = User(username=username)
+        materialized.filter_queryset(Model1.objects.all(), request)
+
+    # The rows are stored with the digest of the canonical key, so they are
+    # shared regardless of the order of the set
+    principal = MaterializedPrincipal.objects.get()
+    assert principal.principal_key == principal_key_digest((frozenset(["a", "b"]),))
+    assert principal.principal == '[["a","b"]]'
+
+    # The decoded key is passed to refresh the rows
+    Model1.objects.create(text="m1")
+    assert principal_keys == [[["a", "b"]]]
+    assert MaterializedPrincipal.objects.exists()
@@ -1,7 +1,12 @@
+import asyncio
+import threading
+from contextlib import nullcontext
+
 import pytest
 from django.core.exceptions import ImproperlyConfigured, PermissionDenied
 from django.urls import reverse
 from rest_framework.exceptions import PermissionDenied as DRFPermissionDenied
+from rest_framework.serializers import Serializer
 from rest_framework.status import (
     HTTP_200_OK,
     HTTP_201_CREATED,
@@ -9,11 +14,17 @@ from rest_framework.status import (
     HTTP_403_FORBIDDEN,
 )
 
-from generic_permissions.config import ObjectPermissionsConfig, PermissionsConfig
+from generic_permissions.config import (
+    ObjectPermissionsConfig,
+    PermissionsConfig,
+    QuerysetPermissionsConfig,
+)
 from generic_permissions.permissions import (
+    AsyncPermissionViewMixin,
     DenyAll,
     object_permission_for,
     permission_for,
+    queryset_permission_for,
 )
 from tests.views import Dummy1ViewSet, Dummy2ViewSet, DummyBaseViewSet
 
@@ -276,3 +287,369 @@ def test_permission_action(db, admin_client, mocker):
     export_response = admin_client.post(reverse("model1-export"), format="json")
     assert export_response.status_code == HTTP_204_NO_CONTENT
     assert spy.call_args_list[2].kwargs["action"] == "export"
+
+
+def test_permission_model(mocker):
+    class View(Dummy1ViewSet):
+        pass
+
+    class QuerysetView(Dummy2ViewSet):
+        serializer_class = Serializer
+
+    get_serializer = mocker.spy(View, "get_serializer")
+    get_serializer_class = mocker.spy(View, "get_serializer_class")
+
+    assert View(action="update").get_permission_model() is Model1
+    assert View(action="update").get_permission_model() is Model1
+    assert View(action="destroy").get_permission_model() is Model1
+
+    # The model is resolved once per view class and action, without
+    # constructing a serializer
+    assert get_serializer_class.call_count == 2
+    assert not get_serializer.called
+
+    # Without a model on the serializer, the queryset's model is used
+    assert QuerysetView(action="update").get_permission_model() is Model2
+
+
+def test_permission_handlers_per_view(db, rf, mocker):
+    class CustomPermission:
+        @object_permission_for(Model1)
+        def has_object_permission(self, request, instance, *args, **kwargs):
+            return True
+
+    ObjectPermissionsConfig.register_handler_class(CustomPermission)
+    get_handlers = mocker.spy(ObjectPermissionsConfig, "_handlers_for_request")
+
+    request = rf.patch("")
+    view = Dummy1ViewSet(request=request, action="partial_update")
+    for _ in range(3):
+        view._check_object_permissions(request, Model1.objects.create())
+
+    assert get_handlers.call_count == 1
+
+
+@pytest.mark.parametrize("denied", [False, True])
+def test_bulk_object_permission(db, rf, mocker, denied):
+    class CustomPermission:
+        @object_permission_for(Model1, bulk=True)
+        def has_object_permission_bulk(self, request, instances, *args, action):
+            return [instance.pk for instance in instances if instance.text != "deny"]
+
+    class SimplePermission:
+        @object_permission_for(Model1)
+        def has_object_permission(self, request, instance, *args, action):
+            return True
+
+    ObjectPermissionsConfig.register_handler_class(CustomPermission)
+    ObjectPermissionsConfig.register_handler_class(SimplePermission)
+    bulk_spy = mocker.spy(CustomPermission, "has_object_permission_bulk")
+    simple_spy = mocker.spy(SimplePermission, "has_object_permission")
+
+    for _ in range(3):
+        Model1.objects.create(text="foo")
+    if denied:
+        Model1.objects.create(text="deny")
+
+    request = rf.patch("")
+    request.authenticators = None
+    view = Dummy1ViewSet(request=request, format_kwarg="json", action="bulk")
+
+    if denied:
+        with pytest.raises(PermissionDenied):
+            view.check_bulk_object_permissions(request, Model1.objects.all())
+    else:
+        view.check_bulk_object_permissions(request, Model1.objects.all())
+
+    # The bulk handler is called once for all objects
+    assert bulk_spy.call_count == 1
+    assert bulk_spy.call_args.kwargs["action"] == "bulk"
+    # The remaining handlers are skipped once access is denied
+    assert simple_spy.call_count == (0 if denied else 3)
+
+    # Single objects are passed to bulk handlers as a list
+    with pytest.raises(PermissionDenied) if denied else nullcontext():
+        view.check_object_permissions(request, Model1.objects.last())
+    assert bulk_spy.call_args.args[2] == [Model1.objects.last()]
+
+
+def test_bulk_object_permission_get(db, rf, mocker):
+    ObjectPermissionsConfig.register_handler_class(DenyAll)
+
+    request = rf.get("")
+    request.authenticators = None
+    Dummy1ViewSet(request=request, format_kwarg="json").check_bulk_object_permissions(
+        request, [Model1.objects.create()]
+    )
+
+
+def test_decorator_options():
+    class CustomPermission:
+        @object_permission_for(Model1, bulk=True)
+        @object_permission_for(Model2, foo="bar")
+        def has_object_permission(self, request, instances, *args, **kwargs):
+            pass  # pragma: no cover
+
+    class SimplePermission:
+        @object_permission_for(Model2)
+        def has_object_permission_simple(self, request, instance, *args, **kwargs):
+            pass  # pragma: no cover
+
+    ObjectPermissionsConfig.clear_handlers()
+    ObjectPermissionsConfig.register_handler_class(CustomPermission)
+    ObjectPermissionsConfig.register_handler_class(SimplePermission)
+
+    options = {
+        handler.__name__: options
+        for handler, options in ObjectPermissionsConfig.get_handlers_with_options(
+            Model2
+        )
+    }
+    assert options == {
+        "has_object_permission": {"bulk": True, "foo": "bar"},
+        "has_object_permission_simple": {},
+    }
+
+
+@pytest.mark.parametrize(
+    "text,status", [("mine", HTTP_200_OK), ("foo", HTTP_403_FORBIDDEN)]
+)
+def test_queryset_permission(db, admin_client, text, status, django_assert_num_queries):
+    class CustomPermission:
+        @queryset_permission_for(Model1)
+        def writable_model1(self, queryset, request, *args, action):
+            assert action == "partial_update"
+            return queryset.filter(text="mine")
+
+    QuerysetPermissionsConfig.register_handler_class(CustomPermission)
+
+    m1 = Model1.objects.create(text=text)
+
+    response = admin_client.patch(
+        reverse("model1-detail", args=[m1.pk]), data={"text": "mine"}
+    )
+    assert response.status_code == status
+
+
+@pytest.mark.parametrize("denied", [False, True])
+def test_bulk_queryset_permission(db, rf, denied, django_assert_num_queries):
+    class CustomPermission:
+        @queryset_permission_for(Model1)
+        def writable_model1(self, queryset, request, *args, **kwargs):
+            return queryset.exclude(text="deny")
+
+    QuerysetPermissionsConfig.register_handler_class(CustomPermission)
+
+    instances = [Model1.objects.create(text="foo") for _ in range(3)]
+    if denied:
+        instances.append(Model1.objects.create(text="deny"))
+
+    request = rf.patch("")
+    request.authenticators = None
+    view = Dummy1ViewSet(request=request, format_kwarg="json")
+
+    with django_assert_num_queries(1):
+        with pytest.raises(PermissionDenied) if denied else nullcontext():
+            view.check_bulk_object_permissions(request, instances)
+
+
+def test_bulk_queryset_permission_joins(db, rf):
+    class CustomPermission:
+        @queryset_permission_for(Model1)
+        def writable_model1(self, queryset, request, *args, **kwargs):
+            return queryset.filter(many__text__startswith="ok")
+
+    QuerysetPermissionsConfig.register_handler_class(CustomPermission)
+
+    # Both relations match, so the joined queryset contains the object twice
+    model1 = Model1.objects.create(text="foo")
+    model1.many.add(
+        Model2.objects.create(text="ok1"), Model2.objects.create(text="ok2")
+    )
+
+    request = rf.patch("")
+    request.authenticators = None
+    view = Dummy1ViewSet(request=request, format_kwarg="json")
+    view.check_bulk_object_permissions(request, [model1])
+
+
+@pytest.mark.parametrize("permission_class", [None, DenyAll, "custom"])
+def test_writable_queryset(db, rf, permission_class):
+    class CustomPermission:
+        @queryset_permission_for(Model1)
+        def writable_model1(self, queryset, request, *args, **kwargs):
+            return queryset.filter(text="mine")
+
+    QuerysetPermissionsConfig.clear_handlers()
+    if permission_class == "custom":
+        QuerysetPermissionsConfig.register_handler_class(CustomPermission)
+    elif permission_class:
+        QuerysetPermissionsConfig.register_handler_class(permission_class)
+
+    mine = Model1.objects.create(text="mine")
+    other = Model1.objects.create(text="other")
+
+    request = rf.get("")
+    view = Dummy1ViewSet(request=request, format_kwarg="json")
+
+    expected = {
+        None: {mine.pk: True, other.pk: True},
+        DenyAll: {mine.pk: False, other.pk: False},
+        "custom": {mine.pk: True, other.pk: False},
+    }[permission_class]
+
+    annotated = view.annotate_writable(Model1.objects.all())
+    assert {m1.pk: m1.can_edit for m1 in annotated} == expected
+
+    writable = {pk for pk, can_edit in expected.items() if can_edit}
+    assert {m1.pk for m1 in view.get_writable_queryset()} == writable
+    assert {
+        m1.pk for m1 in view.get_writable_queryset(Model1.objects.filter(text="mine"))
+    } == writable & {mine.pk}
+
+
+class AsyncDummy1ViewSet(AsyncPermissionViewMixin, Dummy1ViewSet):
+    pass
+
+
+@pytest.mark.parametrize("granted", [True, False])
+def test_async_permission(db, rf, granted):
+    # Both handlers wait for each other, which only works if they are
+    # awaited concurrently
+    barrier = asyncio.Barrier(2)
+
+    class AsyncPermission:
+        @permission_for(Model1)
+        async def has_permission(self, request, *args, action):
+            async with asyncio.timeout(1):
+                await barrier.wait()
+            return granted
+
+    class OtherAsyncPermission:
+        @permission_for(Model1)
+        async def has_permission(self, request, *args, action):
+            async with asyncio.timeout(1):
+                await barrier.wait()
+            return True
+
+    class SyncPermission:
+        @permission_for(Model1)
+        def has_permission(self, request, *args, action):
+            return Model1.objects.count() == 0
+
+    PermissionsConfig.clear_handlers()
+    PermissionsConfig.register_handler_class(AsyncPermission)
+    PermissionsConfig.register_handler_class(OtherAsyncPermission)
+    PermissionsConfig.register_handler_class(SyncPermission)
+
+    request = rf.post("")
+    request.authenticators = None
+    view = AsyncDummy1ViewSet(request=request, format_kwarg="json", action="create")
+
+    with nullcontext() if granted else pytest.raises(PermissionDenied):
+        view.check_permissions(request)
+
+
+@pytest.mark.parametrize("denied", [False, True])
+def test_async_object_permission(db, rf, denied):
+    bulk_calls = []
+
+    class AsyncPermission:
+        @object_permission_for(Model1)
+        async def has_object_permission(self, request, instance, *args, action):
+            return instance.text != "deny"
+
+    class AsyncBulkPermission:
+        @object_permission_for(Model1, bulk=True)
+        async def has_object_permission(self, request, instances, *args, action):
+            bulk_calls.append(instances)
+            return [instance.pk for instance in instances]
+
+    class WritablePermission:
+        @queryset_permission_for(Model1)
+        def writable_model1(self, queryset, request, *args, action):
+            return queryset.exclude(text="readonly")
+
+    ObjectPermissionsConfig.clear_handlers()
+    ObjectPermissionsConfig.register_handler_class(AsyncPermission)
+    ObjectPermissionsConfig.register_handler_class(AsyncBulkPermission)
+    QuerysetPermissionsConfig.register_handler_class(WritablePermission)
+
+    for _ in range(3):
+        Model1.objects.create(text="foo")
+
+    request = rf.patch("")
+    request.authenticators = None
+    view = AsyncDummy1ViewSet(request=request, format_kwarg="json", action="bulk")
+
+    view.check_bulk_object_permissions(request, Model1.objects.all())
+    assert len(bulk_calls) == 1
+
+    instance = Model1.objects.create(text="deny" if denied else "foo")
+    with pytest.raises(PermissionDenied) if denied else nullcontext():
+        view.check_object_permissions(request, instance)
+
+    with pytest.raises(PermissionDenied):
+        view.check_object_permissions(request, Model1.objects.create(text="readonly"))
+
+
+@pytest.mark.parametrize("use_setting", [True, False])
+def test_concurrent_permissions(db, rf, mocker, settings, use_setting):
+    # Both handlers wait for each other, which only works if they run
+    # concurrently
+    barrier = threading.Barrier(2, timeout=1)
+
+    class FirstPermission:
+        @permission_for(Model1)
+        def has_permission(self, request, *args, action):
+            barrier.wait()
+            return True
+
+    class SecondPermission:
+        @permission_for(Model1)
+        def has_permission(self, request, *args, action):
+            barrier.wait()
+            return True
+
+    PermissionsConfig.clear_handlers()
+    PermissionsConfig.register_handler_class(FirstPermission)
+    PermissionsConfig.register_handler_class(SecondPermission)
+
+    if use_setting:
+        settings.GENERIC_PERMISSIONS_CONCURRENT_PERMISSIONS = True
+    else:
+        mocker.patch.object(Dummy1ViewSet, "concurrent_permissions", True)
+
+    request = rf.post("")
+    view = Dummy1ViewSet(request=request, action="create")
+    view._check_permissions(request)
+
+
+def test_concurrent_permissions_denied(db, rf, mocker, settings):
+    release = threading.Event()
+
+    class DenyingPermission:
+        @object_permission_for(Model1)
+        def has_object_permission(self, request, instance, *args, action):
+            return False
+
+    class BlockingPermission:
+        @object_permission_for(Model1)
+        def has_object_permission(self, request, instance, *args, action):
+            return release.wait(timeout=5)
+
+    ObjectPermissionsConfig.clear_handlers()
+    ObjectPermissionsConfig.register_handler_class(BlockingPermission)
+    ObjectPermissionsConfig.register_handler_class(DenyingPermission)
+
+    settings.GENERIC_PERMISSIONS_CONCURRENT_MAX_WORKERS = 2
+    mocker.patch.object(Dummy1ViewSet, "concurrent_permissions", True)
+
+    request = rf.patch("")
+    view = Dummy1ViewSet(request=request, action="partial_update")
+
+    # The denial is raised without waiting for the outstanding checks
+    with pytest.raises(PermissionDenied):
+        view._check_object_permissions(request, Model1.objects.create())
+    assert not release.is_set()
+    release.set()
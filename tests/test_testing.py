@@ -0,0 +1,79 @@
+import warnings
+
+import pytest
+from django.urls import reverse
+
+from generic_permissions.config import VisibilitiesConfig
+from generic_permissions.instrumentation import VisibilityQueryWarning
+from generic_permissions.testing import count_visibility_queries
+from generic_permissions.visibilities import filter_queryset_for
+
+from .models import Model1, Model2
+from .views import BulkDummy1ViewSet
+
+
+class Model2Visibility:
+    @filter_queryset_for(Model2)
+    def filter_queryset_for_model2(self, queryset, request):
+        return queryset.exclude(text="hidden")
+
+
+@pytest.fixture
+def model1s(db):
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(Model2Visibility)
+
+    def create(num_rows):
+        for _ in range(num_rows):
+            model2 = Model2.objects.create(text="visible")
+            model1 = Model1.objects.create(text="foo", model2=model2)
+            model1.many.add(model2, Model2.objects.create(text="hidden"))
+
+    return create
+
+
+@pytest.mark.parametrize("num_rows", [1, 5])
+def test_count_visibility_queries(admin_client, model1s, num_rows):
+    model1s(num_rows)
+
+    with count_visibility_queries() as counter:
+        response = admin_client.get(reverse("bulk-model1-list"))
+    assert response.status_code == 200
+
+    # The foreign keys are checked in bulk, the many related fields per row
+    assert counter.count == 1 + 2 * num_rows
+    assert len(counter.queries) == counter.count
+
+
+def test_assert_visibility_queries(
+    admin_client, model1s, mocker, dgap_assert_visibility_queries
+):
+    model1s(5)
+
+    with pytest.raises(AssertionError, match="at most 2 visibility queries"):
+        with dgap_assert_visibility_queries(max=2):
+            admin_client.get(reverse("bulk-model1-list"))
+
+    # Prefetching the many related fields keeps the queries constant
+    mocker.patch.object(BulkDummy1ViewSet, "visible_prefetch", ["many"])
+    with dgap_assert_visibility_queries(max=2) as counter:
+        admin_client.get(reverse("bulk-model1-list"))
+    assert counter.count == 1
+
+
+@pytest.mark.parametrize("prefetch", [True, False])
+def test_visibility_query_warning(admin_client, model1s, mocker, settings, prefetch):
+    model1s(5)
+    settings.GENERIC_PERMISSIONS_DETECT_VISIBILITY_N_PLUS_ONE = True
+    if prefetch:
+        mocker.patch.object(BulkDummy1ViewSet, "visible_prefetch", ["many"])
+
+    if prefetch:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", VisibilityQueryWarning)
+            admin_client.get(reverse("bulk-model1-list"))
+    else:
+        with pytest.warns(
+            VisibilityQueryWarning, match="5 rows of BulkTestModel1Serializer"
+        ):
+            admin_client.get(reverse("bulk-model1-list"))
@@ -1,8 +1,16 @@
+import pytest
+from asgiref.sync import async_to_sync
 from django.urls import reverse
+from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 from generic_permissions.config import ValidatorsConfig
-from generic_permissions.validation import validator_for
+from generic_permissions.validation import (
+    AsyncValidatorMixin,
+    ValidatorListSerializer,
+    ValidatorMixin,
+    validator_for,
+)
 
 from .models import Model1, Model2
 
@@ -52,3 +60,143 @@ def test_custom_validation(db, admin_client):
     # Also check in DB
     model1.refresh_from_db()
     assert model1.text == "some uppercase text"
+
+
+class BulkModel1Serializer(ValidatorMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Model1
+        fields = ["text"]
+        list_serializer_class = ValidatorListSerializer
+
+
+@pytest.mark.parametrize("num_items", [1, 5])
+def test_bulk_validation(db, rf, mocker, num_items):
+    class BulkValidator:
+        @validator_for(Model1, bulk=True)
+        def validate_texts(self, data, context):
+            known = set(Model1.objects.values_list("text", flat=True))
+            if any(item["text"] in known for item in data):
+                raise ValidationError("Duplicate text")
+            return [{**item, "text": item["text"].upper()} for item in data]
+
+    class ItemValidator:
+        @validator_for(Model1)
+        def validate_text(self, data, context):
+            return data
+
+    ValidatorsConfig.clear_handlers()
+    ValidatorsConfig.register_handler_class(BulkValidator)
+    ValidatorsConfig.register_handler_class(ItemValidator)
+    bulk_spy = mocker.spy(BulkValidator, "validate_texts")
+    item_spy = mocker.spy(ItemValidator, "validate_text")
+
+    context = {"request": rf.post("/")}
+    data = [{"text": f"text {i}"} for i in range(num_items)]
+
+    serializer = BulkModel1Serializer(data=data, many=True, context=context)
+    assert serializer.is_valid()
+    assert serializer.validated_data == [
+        {"text": f"TEXT {i}"} for i in range(num_items)
+    ]
+
+    # The bulk validator is called once for all items
+    assert bulk_spy.call_count == 1
+    assert item_spy.call_count == num_items
+
+    # Single items are passed to bulk validators as a list
+    serializer = BulkModel1Serializer(data=data[0], context=context)
+    assert serializer.is_valid()
+    assert serializer.validated_data == {"text": "TEXT 0"}
+    assert bulk_spy.call_count == 2
+
+    Model1.objects.create(text="text 0")
+    serializer = BulkModel1Serializer(data=data, many=True, context=context)
+    assert not serializer.is_valid()
+    assert serializer.errors == {"non_field_errors": ["Duplicate text"]}
+
+
+@pytest.mark.parametrize("collect_errors", [False, True])
+def test_validation_cost(db, rf, mocker, collect_errors):
+    calls = []
+
+    class ExpensiveValidator:
+        @validator_for(Model1, cost=10)
+        def validate_expensive(self, data, context):
+            calls.append("expensive")
+            raise ValidationError({"text": "Expensive"})
+
+    class CheapValidator:
+        @validator_for(Model1, cost=-1)
+        def validate_cheap(self, data, context):
+            calls.append("cheap")
+            raise ValidationError({"text": "Cheap"})
+
+    class DefaultValidator:
+        @validator_for(Model1)
+        def validate_default(self, data, context):
+            calls.append("default")
+            raise ValidationError("Default")
+
+    ValidatorsConfig.clear_handlers()
+    ValidatorsConfig.register_handler_class(ExpensiveValidator)
+    ValidatorsConfig.register_handler_class(DefaultValidator)
+    ValidatorsConfig.register_handler_class(CheapValidator)
+    mocker.patch.object(
+        BulkModel1Serializer, "collect_validation_errors", collect_errors
+    )
+
+    serializer = BulkModel1Serializer(
+        data={"text": "foo"}, context={"request": rf.post("/")}
+    )
+    assert not serializer.is_valid()
+
+    if collect_errors:
+        # All validators run, cheapest first, and all errors are reported
+        assert calls == ["cheap", "default", "expensive"]
+        assert serializer.errors == {
+            "text": ["Cheap", "Expensive"],
+            "non_field_errors": ["Default"],
+        }
+    else:
+        # The first error stops the validation
+        assert calls == ["cheap"]
+        assert serializer.errors == {"text": ["Cheap"]}
+
+
+def test_async_validation(db, rf):
+    class AsyncModel1Serializer(AsyncValidatorMixin, serializers.ModelSerializer):
+        class Meta:
+            model = Model1
+            fields = ["text"]
+
+    class AsyncValidator:
+        @validator_for(Model1)
+        async def validate_text(self, data, context):
+            if data["text"] == "invalid":
+                raise ValidationError("Invalid")
+            return {**data, "text": data["text"].upper()}
+
+    class SyncValidator:
+        @validator_for(Model1)
+        def validate_text(self, data, context):
+            # Sync validators may still query the database
+            assert not Model1.objects.exists()
+            return data
+
+    ValidatorsConfig.clear_handlers()
+    ValidatorsConfig.register_handler_class(AsyncValidator)
+    ValidatorsConfig.register_handler_class(SyncValidator)
+
+    async def validate(text):
+        serializer = AsyncModel1Serializer(
+            data={"text": text}, context={"request": rf.post("/")}
+        )
+        return await serializer.ais_valid(), serializer
+
+    is_valid, serializer = async_to_sync(validate)("foo")
+    assert is_valid
+    assert serializer.validated_data == {"text": "FOO"}
+
+    is_valid, serializer = async_to_sync(validate)("invalid")
+    assert not is_valid
+    assert serializer.errors == {"non_field_errors": ["Invalid"]}
@@ -1,18 +1,35 @@
+import json
+from collections import namedtuple
+
 import pytest
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
+from django.db.models.functions import Length
 from django.urls import reverse
 from rest_framework import serializers
 from rest_framework.request import Request
 from rest_framework.status import HTTP_200_OK, HTTP_404_NOT_FOUND
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
 
+from generic_permissions import visibilities
 from generic_permissions.config import VisibilitiesConfig
 from generic_permissions.visibilities import (
+    AsyncVisibilityViewMixin,
+    Cached,
+    Intersection,
     Union,
+    VisibilityListSerializer,
     VisibilityPrimaryKeyRelatedField,
+    VisibilitySerializerMixin,
     filter_queryset_for,
 )
 
+from .conftest import User
 from .models import BaseModel, Model1, Model2
+from .serializers import BulkTestModel1Serializer
+from .serializers import TestModel1Serializer as Model1Serializer
+from .views import BulkDummy1ViewSet, Dummy1ViewSet, Dummy2ViewSet
 
 
 @pytest.mark.parametrize("has_qs", [True, False])
@@ -237,6 +254,151 @@ def test_union_visibility_none(db, admin_client):
     assert len(admin_client.get(url).json()) == 0
 
 
+@pytest.mark.parametrize(
+    "pure_filters,expect_subquery",
+    [
+        ([], True),
+        (["m1", "m2"], True),
+        (["m1", "m2", "m3"], False),
+        (["m1", "m2", "m3", "none"], False),
+    ],
+)
+def test_union_visibility_pure_filters(db, rf, pure_filters, expect_subquery):
+    for text in "m1", "m2", "m3", "m4":
+        Model1.objects.create(text=text)
+
+    def make_visibility(name, texts):
+        class TextVisibility:
+            pure_filter = name in pure_filters
+
+            @filter_queryset_for(Model1)
+            def filter_queryset_for_model1(self, queryset, request):
+                return queryset.filter(text__in=texts)
+
+        return TextVisibility
+
+    class NoneVisibility:
+        pure_filter = "none" in pure_filters
+
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):
+            return queryset.none()
+
+    class ConfiguredUnion(Union):
+        visibility_classes = [
+            make_visibility("m1", ["m1"]),
+            make_visibility("m2", ["m2"]),
+            make_visibility("m3", ["m2", "m3"]),
+            NoneVisibility,
+        ]
+
+    queryset = ConfiguredUnion().filter_queryset(Model1.objects.all(), rf.get("/"))
+
+    assert sorted(queryset.values_list("text", flat=True)) == ["m1", "m2", "m3"]
+    # Pure filters are combined in the WHERE clause, without any subquery
+    assert ("IN (SELECT" in str(queryset.query)) == expect_subquery
+
+
+def test_union_visibility_distinct_pure_filters(db, rf):
+    visible = Model2.objects.create(text="visible")
+    model1 = Model1.objects.create(text="m1")
+    model1.many.add(visible, Model2.objects.create(text="visible"))
+    Model1.objects.create(text="m2")
+    Model1.objects.create(text="m3")
+
+    class ManyVisibility:
+        pure_filter = True
+
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):
+            return queryset.filter(many__text="visible").distinct()
+
+    class TextVisibility:
+        pure_filter = True
+
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):
+            return queryset.filter(text="m2")
+
+    class ConfiguredUnion(Union):
+        visibility_classes = [ManyVisibility, TextVisibility]
+
+    queryset = ConfiguredUnion().filter_queryset(Model1.objects.all(), rf.get("/"))
+    assert sorted(queryset.values_list("text", flat=True)) == ["m1", "m2"]
+
+
+@pytest.mark.parametrize("is_admin", [True, False])
+def test_intersection_visibility(db, rf, is_admin):
+    for text in "m1", "m2", "m3":
+        Model1.objects.create(text=text)
+
+    calls = []
+
+    class ExpensiveVisibility:
+        visibility_cost = 10
+
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):
+            calls.append("expensive")
+            return queryset.exclude(text="m3")
+
+    class AdminOnlyVisibility:
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):
+            calls.append("admin")
+            return queryset if request.user.username == "admin" else queryset.none()
+
+    class CheapVisibility:
+        visibility_cost = -1
+
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):
+            calls.append("cheap")
+            return queryset.exclude(text="m1")
+
+    class ConfiguredIntersection(Intersection):
+        visibility_classes = [
+            ExpensiveVisibility,
+            AdminOnlyVisibility,
+            CheapVisibility,
+        ]
+
+    request = rf.get("/")
+    request.user = namedtuple("User", "username")("admin" if is_admin else "user")
+    queryset = ConfiguredIntersection().filter_queryset(Model1.objects.all(), request)
+
+    if is_admin:
+        assert list(queryset.values_list("text", flat=True)) == ["m2"]
+        assert calls == ["cheap", "admin", "expensive"]
+    else:
+        # The expensive visibility is skipped once nothing is visible anymore
+        assert not queryset.exists()
+        assert calls == ["cheap", "admin"]
+
+
+def test_union_visibility_short_circuit(db, rf):
+    Model1.objects.create(text="m1")
+    Model1.objects.create(text="m2")
+
+    class EverythingVisibility:
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):
+            return queryset
+
+    class ExpensiveVisibility:
+        visibility_cost = 10
+
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):  # pragma: no cover
+            raise AssertionError("Must not be evaluated")
+
+    class ConfiguredUnion(Union):
+        visibility_classes = [ExpensiveVisibility, EverythingVisibility]
+
+    queryset = ConfiguredUnion().filter_queryset(Model1.objects.all(), rf.get("/"))
+    assert queryset.count() == 2
+
+
 @pytest.mark.parametrize("has_qs", [True, False])
 @pytest.mark.parametrize("filter_relation", [True, False])
 def test_visibility_relation(
@@ -396,3 +558,758 @@ def test_visibility_no_handlers(db, admin_client, django_assert_num_queries):
         response = admin_client.get(reverse("model2-detail", args=[model2.pk]))
 
     assert response.status_code == HTTP_200_OK
+
+
+@pytest.mark.parametrize("has_qs", [True, False])
+@pytest.mark.parametrize("exists_check", [True, False])
+def test_visibility_exists_check(
+    db, admin_client, has_qs, exists_check, mocker, django_assert_num_queries
+):
+    class TestVisibility:
+        @filter_queryset_for(Model2)
+        def filter_queryset_for_model2(self, queryset, request):
+            return self.visibility(queryset, request)
+
+        @classmethod
+        def visibility(cls, queryset, request):
+            assert isinstance(request, Request)
+            assert queryset.model is Model2
+            return queryset.exclude(text="apple")
+
+    spy = mocker.spy(TestVisibility, "visibility")
+    mocker.patch.object(Dummy2ViewSet, "visibility_exists_check", exists_check)
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(TestVisibility)
+
+    if has_qs:
+        Model2.objects.create(text="apple")
+        Model2.objects.create(text="pear")
+
+    # Without the check, only the filtered query itself is run
+    with django_assert_num_queries(2 if exists_check else 1):
+        response = admin_client.get(reverse("model2-list"))
+
+    assert response.status_code == HTTP_200_OK
+    assert [row["text"] for row in response.json()] == (["pear"] if has_qs else [])
+    # The handlers are only skipped for empty querysets with the check
+    assert spy.call_count == int(has_qs or not exists_check)
+
+
+def test_visibility_queryset_memoized(db, admin_user, mocker):
+    class TestVisibility:
+        @filter_queryset_for(Model2)
+        def filter_queryset_for_model2(self, queryset, request):
+            return self.visibility(queryset, request)
+
+        @classmethod
+        def visibility(cls, queryset, request):
+            return queryset.exclude(text="apple")
+
+    spy = mocker.spy(TestVisibility, "visibility")
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(TestVisibility)
+
+    Model2.objects.create(text="apple")
+    Model2.objects.create(text="pear")
+
+    request = Request(APIRequestFactory().get("/"))
+    view = Dummy2ViewSet(request=request, format_kwarg=None)
+
+    first, second = view.get_queryset(), view.get_queryset()
+    assert spy.call_count == 1
+    assert first is not second
+    assert [m.text for m in first] == [m.text for m in second] == ["pear"]
+
+    view.invalidate_visible_queryset()
+    view.get_queryset()
+    assert spy.call_count == 2
+
+    view.request = Request(APIRequestFactory().get("/"))
+    view.get_queryset()
+    assert spy.call_count == 3
+
+
+def test_visibility_queryset_memoized_empty(db, mocker):
+    class TestVisibility:
+        @filter_queryset_for(Model2)
+        def filter_queryset_for_model2(self, queryset, request):
+            return queryset.exclude(text="secret")
+
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(TestVisibility)
+
+    request = Request(APIRequestFactory().get("/"))
+    view = Dummy2ViewSet(request=request, format_kwarg=None)
+
+    # The handlers are skipped for the empty queryset, so it isn't reused once
+    # rows are created during the request
+    assert not view.get_queryset().exists()
+    Model2.objects.create(text="secret")
+    Model2.objects.create(text="public")
+    assert [m.text for m in view.get_queryset()] == ["public"]
+
+
+class BulkModel1Serializer(VisibilitySerializerMixin, serializers.ModelSerializer):
+    serializer_related_field = VisibilityPrimaryKeyRelatedField
+
+    class Meta:
+        model = Model1
+        fields = ["id", "model2"]
+        list_serializer_class = VisibilityListSerializer
+
+
+@pytest.mark.parametrize("num_rows", [1, 10])
+@pytest.mark.parametrize(
+    "bypass_fields,has_handlers,expected_queries",
+    [
+        (None, True, 2),
+        (None, False, 1),
+        ({"tests.Model1": ["model2"]}, True, 1),
+    ],
+)
+def test_visibility_relation_bulk(
+    db,
+    settings,
+    num_rows,
+    bypass_fields,
+    has_handlers,
+    expected_queries,
+    mocker,
+    django_assert_num_queries,
+):
+    class TestVisibility:
+        @filter_queryset_for(Model2)
+        def filter_queryset_for_model2(self, queryset, request):
+            return self.visibility(queryset, request)
+
+        @classmethod
+        def visibility(cls, queryset, request):
+            return queryset.exclude(text="apple")
+
+    spy = mocker.spy(TestVisibility, "visibility")
+
+    settings.GENERIC_PERMISSIONS_BYPASS_VISIBILITIES = bypass_fields
+    VisibilitiesConfig.clear_handlers()
+    if has_handlers:
+        VisibilitiesConfig.register_handler_class(TestVisibility)
+
+    apple = Model2.objects.create(text="apple")
+    pear = Model2.objects.create(text="pear")
+    for i in range(num_rows):
+        Model1.objects.create(text=str(i), model2=apple if i % 2 else pear)
+    Model1.objects.create(text="empty")
+
+    request = Request(APIRequestFactory().get("/"))
+    serializer = BulkModel1Serializer(
+        Model1.objects.order_by("pk"), many=True, context={"request": request}
+    )
+
+    # One query for the rows, and one for the visibility of all related objects
+    with django_assert_num_queries(expected_queries):
+        result = serializer.data
+
+    filtered = has_handlers and not bypass_fields
+    assert spy.call_count == int(filtered)
+    assert [row["model2"] for row in result] == [
+        apple.pk if i % 2 and not filtered else pear.pk if not i % 2 else None
+        for i in range(num_rows)
+    ] + [None]
+
+
+@pytest.mark.parametrize("allow_null,expected", [(True, None), (False, "skip")])
+def test_visibility_relation_bulk_missing_attribute(db, allow_null, expected):
+    class Model1Serializer(BulkModel1Serializer):
+        class Meta(BulkModel1Serializer.Meta):
+            extra_kwargs = {"model2": {"allow_null": allow_null, "required": False}}
+
+    request = Request(APIRequestFactory().get("/"))
+    serializer = Model1Serializer([{"id": 1}], many=True, context={"request": request})
+
+    assert serializer.data[0].get("model2", "skip") == expected
+
+
+@pytest.mark.parametrize("num_rows", [1, 10])
+@pytest.mark.parametrize("bulk", [True, False])
+@pytest.mark.parametrize("bypass", [True, False])
+def test_visibility_many_relation_prefetched(
+    db, settings, num_rows, bulk, bypass, django_assert_num_queries
+):
+    class TestVisibility:
+        @filter_queryset_for(Model2)
+        def filter_queryset_for_model2(self, queryset, request):
+            return queryset.exclude(text="apple")
+
+    if bypass:
+        settings.GENERIC_PERMISSIONS_BYPASS_VISIBILITIES = {"tests.Model1": ["many"]}
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(TestVisibility)
+
+    apple = Model2.objects.create(text="apple")
+    pear = Model2.objects.create(text="pear")
+    for i in range(num_rows):
+        Model1.objects.create(text=str(i)).many.set([apple, pear])
+
+    request = Request(APIRequestFactory().get("/"))
+    queryset = Model1.objects.prefetch_related("many").order_by("pk")
+
+    if bulk:
+        serializer = BulkTestModel1Serializer(
+            queryset, many=True, context={"request": request}
+        )
+    else:
+        serializer = serializers.ListSerializer(
+            queryset,
+            child=Model1Serializer(context={"request": request}),
+            context={"request": request},
+        )
+
+    # One query each for the rows, the prefetched relations and the visibility
+    # of the related objects, independent of the number of rows
+    with django_assert_num_queries(3):
+        result = serializer.data
+
+    for row in result:
+        assert row["many"] == ([apple.pk, pear.pk] if bypass else [pear.pk])
+        assert row["explicit"] == [pear.pk]
+
+
+@pytest.mark.parametrize("num_rows", [1, 10])
+def test_visibility_prefetch(
+    db, admin_client, num_rows, mocker, django_assert_num_queries
+):
+    class TestVisibility:
+        @filter_queryset_for(Model2)
+        def filter_queryset_for_model2(self, queryset, request):
+            return queryset.exclude(text="apple")
+
+    mocker.patch.object(BulkDummy1ViewSet, "visible_prefetch", ["many", "model2"])
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(TestVisibility)
+
+    apple = Model2.objects.create(text="apple")
+    pear = Model2.objects.create(text="pear")
+    for i in range(num_rows):
+        model1 = Model1.objects.create(text=str(i), model2=apple if i % 2 else pear)
+        model1.many.set([apple, pear])
+
+    # The many-to-many relations are served from the visible prefetch. This
+    # leaves the rows, the two prefetches and the bulk check of the foreign keys
+    with django_assert_num_queries(4):
+        response = admin_client.get(reverse("bulk-model1-list"))
+
+    assert response.status_code == HTTP_200_OK
+    for i, row in enumerate(response.json()):
+        assert row["many"] == [pear.pk]
+        assert row["explicit"] == [pear.pk]
+        assert row["model2"] == (None if i % 2 else pear.pk)
+
+    # Updates must not lose the hidden relations
+    response = admin_client.patch(
+        reverse("bulk-model1-detail", args=[model1.pk]), {"many": [pear.pk]}
+    )
+    assert response.status_code == HTTP_200_OK
+    assert set(model1.many.values_list("pk", flat=True)) == {apple.pk, pear.pk}
+
+
+@pytest.mark.parametrize("num_rows", [0, 5])
+def test_visibility_export_stream(
+    db, admin_client, num_rows, mocker, django_assert_num_queries
+):
+    class TestVisibility:
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):
+            return queryset.exclude(text="hidden")
+
+        @filter_queryset_for(Model2)
+        def filter_queryset_for_model2(self, queryset, request):
+            return queryset.exclude(text="apple")
+
+    mocker.patch.object(BulkDummy1ViewSet, "visible_prefetch", ["many"])
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(TestVisibility)
+
+    apple = Model2.objects.create(text="apple")
+    pear = Model2.objects.create(text="pear")
+    Model1.objects.create(text="hidden")
+    for i in range(num_rows):
+        model1 = Model1.objects.create(text=str(i), model2=apple if i % 2 else pear)
+        model1.many.set([apple, pear])
+
+    prefetch = mocker.spy(visibilities, "prefetch_related_objects")
+    response = admin_client.get(reverse("bulk-model1-export-stream"))
+    assert response.status_code == HTTP_200_OK
+    assert response["Content-Type"] == "application/json"
+
+    # The rows are fetched with one query and serialized in chunks of two.
+    # Each chunk runs the prefetch and the bulk check of the foreign keys
+    with django_assert_num_queries(1 + (num_rows + 1) // 2 * 2):
+        content = b"".join(response.streaming_content)
+
+    # The prefetches are run on the chunks, as `iterator()` ignores them on
+    # older Django versions
+    assert prefetch.call_count == (num_rows + 1) // 2
+    assert all(
+        [lookup.prefetch_to for lookup in call.args[1:]] == ["many"]
+        for call in prefetch.call_args_list
+    )
+
+    assert json.loads(content) == admin_client.get(reverse("bulk-model1-list")).json()
+    assert len(json.loads(content)) == num_rows
+
+
+def test_cached_visibility(db, admin_client, client, mocker):
+    class Model1Visibility:
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):
+            return self.visibility(queryset, request)
+
+        @classmethod
+        def visibility(cls, queryset, request):
+            if request.user.username == "admin":
+                return queryset
+            return queryset.filter(many__text="visible")
+
+    class CachedVisibility(Cached):
+        visibility_classes = [Model1Visibility]
+        invalidate_on = [Model1]
+
+        def get_cache_key(self, request):
+            return request.user.username
+
+    spy = mocker.spy(Model1Visibility, "visibility")
+    cache.clear()
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(CachedVisibility)
+
+    visible = Model2.objects.create(text="visible")
+    Model1.objects.create(text="m1").many.add(visible)
+    Model1.objects.create(text="m2")
+    url = reverse("model1-list")
+
+    def get_texts(client):
+        return sorted(row["text"] for row in client.get(url).json())
+
+    assert get_texts(client) == ["m1"]
+    assert get_texts(admin_client) == ["m1", "m2"]
+    assert spy.call_count == 2
+
+    # Subsequent requests are served from the cache
+    assert get_texts(client) == ["m1"]
+    assert get_texts(admin_client) == ["m1", "m2"]
+    assert spy.call_count == 2
+
+    # Models without handlers are not cached
+    assert len(client.get(reverse("model2-list")).json()) == 1
+
+    # Changes to the configured models invalidate the cache
+    Model1.objects.create(text="m3").many.add(visible)
+    assert get_texts(client) == ["m1", "m3"]
+    assert spy.call_count == 3
+
+    Model1.objects.get(text="m2").many.add(visible)
+    assert get_texts(client) == ["m1", "m2", "m3"]
+    assert spy.call_count == 4
+
+    # As does bumping the version
+    CachedVisibility.cache_version = 2
+    assert get_texts(admin_client) == ["m1", "m2", "m3"]
+    assert spy.call_count == 5
+
+
+def test_cached_visibility_defaults(rf):
+    class CachedVisibility(Cached):
+        pass
+
+    cache.clear()
+    CachedVisibility.invalidate()
+    assert cache.get(CachedVisibility._generation_key()) is None
+
+    request = rf.get("/")
+    request.user = namedtuple("User", "pk")(pk=3)
+    assert CachedVisibility().get_cache_key(request) == 3
+
+
+class RoleVisibility:
+    calls = []
+    compile_filters = True
+
+    def get_principal_key(self, request):
+        return "admin" if request.user.username == "admin" else "user"
+
+    @filter_queryset_for(Model1)
+    def filter_queryset_for_model1(self, queryset, request):
+        self.calls.append(request.user.username)
+        if request.user.username == "admin":
+            return queryset
+        # Filter with a subquery, filters joining multi-valued relations
+        # aren't compiled
+        visible = Model2.objects.filter(text="visible").values("model1s_many")
+        return queryset.filter(pk__in=visible).distinct()
+
+    @filter_queryset_for(Model2)
+    def filter_queryset_for_model2(self, queryset, request):
+        self.calls.append(request.user.username)
+        if request.user.username == "admin":
+            return queryset
+        return queryset.none()
+
+
+def test_visibility_principal_key(db, admin_client, client, mocker):
+    mocker.patch.object(RoleVisibility, "calls", [])
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(RoleVisibility)
+
+    other_client = APIClient()
+    other_client.force_authenticate(user=User(username="other"))
+
+    visible = Model2.objects.create(text="visible")
+    Model1.objects.create(text="m1").many.add(visible)
+    Model1.objects.create(text="m2")
+
+    def get_texts(client, url=None):
+        url = url or reverse("model1-list")
+        return sorted(row["text"] for row in client.get(url).json())
+
+    # The filters are built once per principal key and model, and shared by
+    # the users with that key
+    assert get_texts(client) == ["m1"]
+    assert get_texts(other_client) == ["m1"]
+    assert get_texts(admin_client) == ["m1", "m2"]
+    assert RoleVisibility.calls == ["user", "user", "admin", "admin"]
+
+    # They are only built, so changes to the data are still visible
+    Model1.objects.create(text="m3").many.add(visible)
+    assert get_texts(other_client) == ["m1", "m3"]
+    url = reverse("model2-list")
+    assert get_texts(other_client, url) == []
+    assert get_texts(admin_client, url) == ["visible"]
+    assert len(RoleVisibility.calls) == 4
+
+    visibilities.clear_compiled_filters()
+    assert get_texts(other_client) == ["m1", "m3"]
+    assert RoleVisibility.calls[4:] == ["other", "other"]
+
+
+def test_visibility_principal_key_querysets(db, mocker):
+    mocker.patch.object(RoleVisibility, "calls", [])
+    mocker.patch.object(visibilities, "_COMPILED_FILTERS_MAX_SIZE", 1)
+    request = Request(APIRequestFactory().get("/"))
+    request.user = User(username="user")
+    handler = RoleVisibility().filter_queryset_for_model1
+
+    visible = Model2.objects.create(text="visible")
+    m1 = Model1.objects.create(text="m1")
+    m1.many.add(visible)
+
+    def apply(queryset):
+        return visibilities._apply_handlers(queryset, [handler], request)
+
+    # Querysets that can't be combined are filtered by the handler itself,
+    # without building the filter
+    assert list(apply(Model1.objects.values("text"))) == [{"text": "m1"}]
+    assert RoleVisibility.calls == ["user"]
+    # Distinct querysets are combined with the distinct filter
+    assert list(apply(Model1.objects.distinct())) == [m1]
+    assert RoleVisibility.calls == ["user", "user"]
+
+    class AnnotatingVisibility(RoleVisibility):
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):
+            self.calls.append("annotate")
+            return queryset.annotate(length=Length("text")).filter(length__gt=2)
+
+    # As are querysets the filter can't be combined with
+    annotating = AnnotatingVisibility().filter_queryset_for_model1
+    for _ in range(2):
+        assert not visibilities._apply_handlers(
+            Model1.objects.all(), [annotating], request
+        ).exists()
+    assert RoleVisibility.calls[2:] == ["annotate"] * 3
+    del RoleVisibility.calls[2:]
+
+    # Only the most recently used filters are kept
+    request.user = User(username="admin")
+    assert list(apply(Model1.objects.distinct())) == [m1]
+    request.user = User(username="user")
+    assert list(apply(Model1.objects.all())) == [m1]
+    assert RoleVisibility.calls == ["user", "user", "admin", "user"]
+
+
+def test_visibility_compile_filters(db):
+    calls = []
+
+    class Visibility:
+        compile_filters = True
+
+        def get_principal_key(self, request):
+            return "user"
+
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):
+            calls.append("single")
+            return queryset.filter(text="m1")
+
+        @filter_queryset_for(Model2)
+        def filter_queryset_for_model2(self, queryset, request):
+            calls.append("multi")
+            return queryset.filter(model1s_many__text="m1")
+
+    class OptOutVisibility(Visibility):
+        compile_filters = False
+
+    class NoKeyVisibility(Visibility):
+        def get_principal_key(self, request):
+            return None
+
+    class CompiledUnion(Union):
+        compile_filters = True
+        visibility_classes = [Visibility]
+
+    request = Request(APIRequestFactory().get("/"))
+    m1 = Model1.objects.create(text="m1")
+    m1.many.add(Model2.objects.create(text="m2"))
+
+    def apply_twice(handler, model=Model1):
+        return [
+            list(visibilities._apply_handlers(model.objects.all(), [handler], request))
+            for _ in range(2)
+        ]
+
+    # Without opting in, a principal key, or for compositions, the filters
+    # are built for each queryset
+    assert apply_twice(OptOutVisibility().filter_queryset_for_model1) == [[m1]] * 2
+    assert apply_twice(NoKeyVisibility().filter_queryset_for_model1) == [[m1]] * 2
+    assert apply_twice(CompiledUnion().filter_queryset) == [[m1]] * 2
+    assert calls == ["single"] * 6
+
+    # Filters joining multi-valued relations are not compiled either, after
+    # building them once to find out
+    del calls[:]
+    apply_twice(Visibility().filter_queryset_for_model2, Model2)
+    assert calls == ["multi"] * 3
+
+    del calls[:]
+    assert apply_twice(Visibility().filter_queryset_for_model1) == [[m1]] * 2
+    assert calls == ["single"]
+
+    # The filters of other classes are kept when clearing those of a class
+    visibilities.clear_compiled_filters(OptOutVisibility)
+    apply_twice(Visibility().filter_queryset_for_model1)
+    assert calls == ["single"]
+    visibilities.clear_compiled_filters(Visibility)
+    apply_twice(Visibility().filter_queryset_for_model1)
+    assert calls == ["single"] * 2
+
+
+@pytest.mark.parametrize(
+    "principal_key", [{"tenant": 1, "roles": ["user"]}, ["user", "tenant"]]
+)
+def test_visibility_principal_key_unhashable(db, principal_key):
+    calls = []
+
+    class KeyVisibility:
+        compile_filters = True
+
+        def get_principal_key(self, request):
+            return principal_key
+
+        @filter_queryset_for(Model1)
+        def filter_queryset_for_model1(self, queryset, request):
+            calls.append(request)
+            return queryset.filter(text="m1")
+
+    request = Request(APIRequestFactory().get("/"))
+    handler = KeyVisibility().filter_queryset_for_model1
+    m1 = Model1.objects.create(text="m1")
+    Model1.objects.create(text="m2")
+
+    # Unhashable keys are memoized by their digest
+    for _ in range(2):
+        queryset = visibilities._apply_handlers(
+            Model1.objects.all(), [handler], request
+        )
+        assert list(queryset) == [m1]
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("instrumented", [True, False])
+def test_visibility_principal_key_async(db, settings, instrumented):
+    calls = []
+
+    class AsyncRoleVisibility:
+        compile_filters = True
+
+        def get_principal_key(self, request):
+            return request.user.username
+
+        @filter_queryset_for(Model1)
+        async def filter_queryset_for_model1(self, queryset, request):
+            calls.append(request.user.username)
+            return queryset.filter(text="m1")
+
+    if instrumented:
+        settings.GENERIC_PERMISSIONS_INSTRUMENTATION_SINKS = [calls.append]
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(AsyncRoleVisibility)
+    request = Request(APIRequestFactory().get("/"))
+    request.user = User(username="user")
+    m1 = Model1.objects.create(text="m1")
+    Model1.objects.create(text="m2")
+
+    # Async handlers called synchronously are built once per principal key
+    # as well
+    for _ in range(2):
+        handlers = VisibilitiesConfig.get_handlers(Model1)
+        queryset = visibilities._apply_handlers(Model1.objects.all(), handlers, request)
+        assert list(queryset) == [m1]
+    assert calls[0] == "user"
+    assert len(calls) == (2 if instrumented else 1)
+
+
+def test_cached_visibility_principal_key(db, admin_client, client, mocker):
+    class CachedVisibility(Cached):
+        visibility_classes = [RoleVisibility]
+
+    mocker.patch.object(RoleVisibility, "calls", [])
+    cache.clear()
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(CachedVisibility)
+
+    other_client = APIClient()
+    other_client.force_authenticate(user=User(username="other"))
+    Model1.objects.create(text="m1").many.add(Model2.objects.create(text="visible"))
+    Model1.objects.create(text="m2")
+
+    # Users with the same principal key share the cached entries
+    for user_client in [client, other_client, admin_client]:
+        user_client.get(reverse("model1-list"))
+    # Once for each model, as the related fields are checked as well
+    assert RoleVisibility.calls == ["user", "user", "admin", "admin"]
+
+    request = Request(APIRequestFactory().get("/"))
+    request.user = User(username="other")
+    assert CachedVisibility().get_cache_key(request) == ("user",)
+
+    # The cache keys contain the digest of the principal key
+    digest = visibilities.principal_key_digest(("user",))
+    assert cache.get(
+        f"dgap:cached:{CachedVisibility.__module__}.{CachedVisibility.__qualname__}"
+        f":tests.Model1:{digest}:v1:g0"
+    )
+
+
+def test_principal_key_digest():
+    key = (1, frozenset(["b", "a", 2]), {"z": {3, 1}, "y": None})
+    assert visibilities.canonical_principal_key(key) == (
+        '[1,["a","b",2],{"y":null,"z":[1,3]}]'
+    )
+
+    # Equal keys give the same digest, regardless of the order of their sets
+    digest = visibilities.principal_key_digest(key)
+    other = (1, frozenset([2, "a", "b"]), {"y": None, "z": {1, 3}})
+    assert visibilities.principal_key_digest(other) == digest
+    assert len(digest) == 64
+    assert visibilities.principal_key_digest((1, frozenset(["a", "b"]))) != digest
+
+
+@pytest.mark.parametrize("bypass", [True, False])
+def test_visibility_bypass_field_without_model(db, settings, bypass):
+    class TestVisibility:
+        @filter_queryset_for(Model2)
+        def filter_queryset_for_model2(self, queryset, request):
+            return queryset.exclude(text="apple")
+
+    class PlainSerializer(VisibilitySerializerMixin, serializers.Serializer):
+        model2 = VisibilityPrimaryKeyRelatedField(queryset=Model2.objects.all())
+        many = VisibilityPrimaryKeyRelatedField(
+            queryset=Model2.objects.all(), many=True
+        )
+
+    if bypass:
+        settings.GENERIC_PERMISSIONS_BYPASS_VISIBILITIES = {"tests.Model1": "__all__"}
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(TestVisibility)
+
+    apple = Model2.objects.create(text="apple")
+    model1 = Model1.objects.create(text="pear", model2=apple)
+    model1.many.add(apple)
+
+    request = Request(APIRequestFactory().get("/"))
+    data = PlainSerializer(model1, context={"request": request}).data
+
+    # The bypass is resolved from the serialized instance
+    assert data["model2"] == (apple.pk if bypass else None)
+    assert data["many"] == ([apple.pk] if bypass else [])
+
+
+def test_visibility_field_bind_metadata(db, mocker):
+    class TestVisibility:
+        @filter_queryset_for(Model2)
+        def filter_queryset_for_model2(self, queryset, request):
+            return queryset.exclude(text="apple")
+
+    class ReadOnlySerializer(VisibilitySerializerMixin, serializers.ModelSerializer):
+        serializer_related_field = VisibilityPrimaryKeyRelatedField
+
+        class Meta:
+            model = Model1
+            fields = ["model2", "many"]
+            read_only_fields = ["model2", "many"]
+
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(TestVisibility)
+
+    apple = Model2.objects.create(text="apple")
+    pear = Model2.objects.create(text="pear")
+    model1s = [Model1.objects.create(text="a", model2=apple) for _ in range(3)]
+    for model1 in model1s:
+        model1.many.add(apple, pear)
+
+    get_handlers = mocker.spy(VisibilitiesConfig, "_handlers_for_request")
+    request = Request(APIRequestFactory().get("/"))
+    serializer = ReadOnlySerializer(model1s, many=True, context={"request": request})
+    data = serializer.data
+
+    # Read only fields have no queryset, the related model is taken from the
+    # serializer's model instead of the parent instance
+    fields = serializer.child.fields
+    assert fields["model2"]._visibility_model is Model2
+    assert fields["many"]._visibility_model is Model2
+    assert all(row["model2"] is None for row in data)
+    assert all(row["many"] == [pear.pk] for row in data)
+
+    # The handlers are resolved once per field on bind, not per row
+    assert get_handlers.call_count == 2
+
+
+class AsyncDummy1ViewSet(AsyncVisibilityViewMixin, Dummy1ViewSet):
+    pass
+
+
+@pytest.mark.parametrize("action", ["list", "create"])
+def test_async_visibility(db, admin_user, action):
+    class AsyncVisibility:
+        @filter_queryset_for(Model1)
+        async def filter_queryset_for_model1(self, queryset, request):
+            return queryset.exclude(text="hidden")
+
+    VisibilitiesConfig.clear_handlers()
+    VisibilitiesConfig.register_handler_class(AsyncVisibility)
+    Model1.objects.create(text="visible")
+    Model1.objects.create(text="hidden")
+
+    request = APIRequestFactory().get("/")
+    force_authenticate(request, user=admin_user)
+    view = AsyncDummy1ViewSet(action=action, action_map={}, format_kwarg=None)
+    view.request = view.initialize_request(request)
+    view.initial(view.request)
+
+    async def get_texts():
+        # On the event loop, the queryset is only built if it wasn't in `initial`
+        if action == "list":
+            queryset = view.get_queryset()
+        else:
+            queryset = await view.aget_queryset()
+        return await sync_to_async(list)(queryset.values_list("text", flat=True))
+
+    assert async_to_sync(get_texts)() == ["visible"]
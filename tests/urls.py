@@ -5,6 +5,7 @@ from . import views
 r = SimpleRouter()
 
 r.register(r"test1", views.Dummy1ViewSet)
+r.register(r"test1-bulk", views.BulkDummy1ViewSet, basename="bulk-model1")
 r.register(r"test2", views.Dummy2ViewSet)
 
 urlpatterns = r.urls
@@ -26,6 +26,14 @@ class Dummy1ViewSet(PermissionViewMixin, VisibilityViewMixin, ModelViewSet):
     def export(self, request):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False, methods=["GET"])
+    def export_stream(self, request):
+        return self.get_export_response(chunk_size=2)
+
+
+class BulkDummy1ViewSet(Dummy1ViewSet):
+    serializer_class = serializers.BulkTestModel1Serializer
+
 
 class Dummy2ViewSet(PermissionViewMixin, VisibilityViewMixin, ModelViewSet):
     serializer_class = serializers.TestModel2Serializer